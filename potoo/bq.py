@@ -4,9 +4,11 @@
 #   - But verify it works with arrays and structs...
 
 from collections import OrderedDict
+import threading
+
 import pandas as pd
 
-from potoo.pandas import pd_read_bq, bq_default_project
+from potoo.pandas import pd_read_bq, bq_default_project, bq_parse_results_url
 import potoo.pandas_io_gbq_par_io as gbq
 
 
@@ -14,9 +16,28 @@ import potoo.pandas_io_gbq_par_io as gbq
 #   - TODO Needs a little extra setup for auth
 class BQ:
 
-    def __init__(self, project_id):
-        self.project_id = project_id
-        self.service = gbq.GbqConnector(project_id=project_id).service
+    def __init__(self, project_id=None):
+        self._project_id = project_id  # None means bq_default_project()
+        self._service = None
+        self._lock = threading.Lock()
+        self._table_summary_cache = {}  # (project_id, dataset_id, table_id, lastModifiedTime, field name) -> pd.Series
+
+    # Resolve project_id and connect lazily on first use (then cache), since both are slow (gcloud subprocess,
+    # credentials, discovery service) and need to be online, which importing potoo.bq shouldn't
+    @property
+    def project_id(self):
+        with self._lock:
+            if self._project_id is None:
+                self._project_id = bq_default_project()
+            return self._project_id
+
+    @property
+    def service(self):
+        project_id = self.project_id
+        with self._lock:
+            if self._service is None:
+                self._service = gbq.GbqConnector(project_id=project_id).service
+            return self._service
 
     def pd_read(self, *args, **kw):
         # Reuses self.project_id but not self.services (makes its own)
@@ -38,8 +59,102 @@ class BQ:
     def table_schema(self, dataset_id, table_id):
         return self.table_get(dataset_id, table_id)['schema']['fields']
 
-    def table_head(self, dataset_id, table_id, limit=10):
-        return self.pd_read('select * from `%(dataset_id)s.%(table_id)s` limit %(limit)s' % locals())
+    def table_read(self, dataset_id, table_id, columns=None, start=0, n=None, **kwargs):
+        # Reads table storage directly (tabledata.list) instead of querying, so it's free and doesn't wait on a job
+        return gbq.read_gbq_table(
+            dataset_id, table_id, project_id=self.project_id, columns=columns, start_index=start, max_rows=n, **kwargs
+        )
+
+    def table_head(self, dataset_id, table_id, limit=10, columns=None):
+        # tabledata.list only reads tables with their own storage, so query views and external tables instead
+        if self.table_get(dataset_id, table_id)['type'] == 'TABLE':
+            return self.table_read(dataset_id, table_id, columns=columns, n=limit)
+        else:
+            select = ', '.join('`%s`' % c for c in columns) if columns else '*'
+            return self.pd_read('select %(select)s from `%(dataset_id)s.%(table_id)s` limit %(limit)s' % locals())
+
+    # bq.job_plan
+    #   - Same info as the "Explanation" tab in the web ui (what bq_url_for_query links to)
+    #   - https://cloud.google.com/bigquery/query-plan-explanation
+    def job_plan(self, job_id_or_url):
+        """
+        A job's query plan (statistics.query.queryPlan) as a df, one row per stage, with is_bottleneck marking the
+        stage that used the most slot time (or took longest, if slot times aren't reported)
+        """
+        project_id, job_id = self._parse_job_id_or_url(job_id_or_url)
+        job = self.service.jobs().get(projectId=project_id, jobId=job_id).execute()
+        job_start_ms = int(job['statistics'].get('startTime', 0))
+        num = lambda x, type_=int: None if x is None else type_(x)
+        ratio = lambda stage, k: num(stage.get(k), float)
+        df = pd.DataFrame([
+            OrderedDict([
+                ('id', num(stage.get('id'))),
+                ('name', stage['name']),
+                ('status', stage.get('status')),
+                # Relative to job start, for timelines
+                ('start_s', None if 'startMs' not in stage else (int(stage['startMs']) - job_start_ms) / 1000),
+                ('end_s', None if 'endMs' not in stage else (int(stage['endMs']) - job_start_ms) / 1000),
+                ('slot_ms', num(stage.get('slotMs'))),
+                ('records_read', num(stage.get('recordsRead'))),
+                ('records_written', num(stage.get('recordsWritten'))),
+                ('shuffle_output_bytes', num(stage.get('shuffleOutputBytes'))),
+                ('wait_ratio_avg', ratio(stage, 'waitRatioAvg')),
+                ('wait_ratio_max', ratio(stage, 'waitRatioMax')),
+                ('read_ratio_avg', ratio(stage, 'readRatioAvg')),
+                ('read_ratio_max', ratio(stage, 'readRatioMax')),
+                ('compute_ratio_avg', ratio(stage, 'computeRatioAvg')),
+                ('compute_ratio_max', ratio(stage, 'computeRatioMax')),
+                ('write_ratio_avg', ratio(stage, 'writeRatioAvg')),
+                ('write_ratio_max', ratio(stage, 'writeRatioMax')),
+                ('steps', ', '.join(step['kind'] for step in stage.get('steps', []))),
+            ])
+            for stage in job['statistics'].get('query', {}).get('queryPlan', [])
+        ])
+        if len(df):
+            df['duration_s'] = df.end_s - df.start_s
+            cost = df.slot_ms if df.slot_ms.notnull().any() else df.duration_s
+            df['is_bottleneck'] = cost == cost.max()
+        return df
+
+    def job_plan_plot(self, job_id_or_url_or_plan):
+        """
+        Plot a job's query plan as a timeline of stages (or, without stage timings, as each stage's avg
+        wait/read/compute/write ratios), with the bottleneck stage highlighted
+        - Returns the plotnine ggplot, which displays itself in a notebook (else g.draw())
+        """
+        from plotnine import aes, geom_bar, geom_segment, ggplot, labs, coord_flip
+        from potoo.plot import gg_sum
+        if isinstance(job_id_or_url_or_plan, pd.DataFrame):
+            plan = job_id_or_url_or_plan
+        else:
+            plan = self.job_plan(job_id_or_url_or_plan)
+        plan = plan.assign(stage=pd.Categorical(plan['name'], categories=plan['name'][::-1]))  # First stage on top
+        if plan.start_s.notnull().all():
+            return gg_sum(
+                ggplot(plan),
+                geom_segment(aes(x='start_s', xend='end_s', y='stage', yend='stage', color='is_bottleneck'), size=4),
+                labs(x='seconds since job start', y=''),
+            )
+        else:
+            ratios = pd.melt(
+                plan,
+                id_vars=['stage', 'is_bottleneck'],
+                value_vars=['wait_ratio_avg', 'read_ratio_avg', 'compute_ratio_avg', 'write_ratio_avg'],
+                var_name='ratio',
+            )
+            return gg_sum(
+                ggplot(ratios),
+                geom_bar(aes(x='stage', y='value', fill='ratio'), stat='identity'),
+                coord_flip(),
+                labs(x='', y='avg ratio (of slowest shard\'s time)'),
+            )
+
+    def _parse_job_id_or_url(self, job_id_or_url):
+        """
+        e.g. 'bquijob_41b598ad_1614361c9a6', or a results url (see bq_parse_results_url):
+        'https://bigquery.cloud.google.com/results/dwh-v2:bquijob_41b598ad_1614361c9a6'
+        """
+        return bq_parse_results_url(job_id_or_url) or (self.project_id, job_id_or_url)
 
     # bq.table_summary
     #   - cf. https://www.postgresql.org/docs/current/static/view-pg-stats.html
@@ -49,8 +164,39 @@ class BQ:
         self,
         dataset_id,
         table_id,
-        fields_f=lambda xs: xs,  # e.g. to subset when bq barfs on too many things
+        fields_f=lambda xs: xs,  # e.g. to subset
+        max_fields_per_query=50,  # Split wide tables into batches, to stay under bq query limits
     ):
+        # Summarize each field once per version of the table (lastModifiedTime), so re-summarizing an unchanged table
+        # only costs a tables.get
+        table = self.table_get(dataset_id, table_id)
+        fields = fields_f(table['schema']['fields'])
+        cache_key = lambda name: (self.project_id, dataset_id, table_id, table['lastModifiedTime'], name)
+        todo_fields = [field for field in fields if cache_key(field['name']) not in self._table_summary_cache]
+
+        # Run the batches concurrently
+        if todo_fields:
+            import dask
+            batches = [
+                todo_fields[i:i + max_fields_per_query]
+                for i in range(0, len(todo_fields), max_fields_per_query)
+            ]
+            batch_dfs = dask.delayed(list)([
+                dask.delayed(self._table_summary_batch)(dataset_id, table_id, batch)
+                for batch in batches
+            ]).compute(
+                get=dask.threaded.get,
+            )
+            for batch_df in batch_dfs:
+                for _, row in batch_df.iterrows():
+                    self._table_summary_cache[cache_key(row['name'])] = row
+
+        return pd.DataFrame([
+            self._table_summary_cache[cache_key(field['name'])]
+            for field in fields
+        ]).reset_index(drop=True)
+
+    def _table_summary_batch(self, dataset_id, table_id, fields):
         return self.pd_read('''
             select * from unnest((
                 select %(array_agg_expr)s
@@ -68,16 +214,17 @@ class BQ:
                             approx_quantiles(`%(name)s`, 4) as quantiles
                         )
                     ''' % field
-                    for field in fields_f(bq.table_schema(dataset_id, table_id))
+                    for field in fields
                 ),
                 dataset_id = dataset_id,
                 table_id = table_id,
-            )
+            ),
+            categorical_threshold=None,  # Keep plain columns, since batches get stitched together
         )
 
 
-# Connect bq
-bq = BQ(bq_default_project())
+# Connects lazily, on first use
+bq = BQ()
 
 # XXX Testing
 # importlib.reload(gbq)
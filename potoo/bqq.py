@@ -1,21 +1,79 @@
 # TODO Throw away potoo.bq and rename this to replace it (potoo.bqq -> potoo.bq)
 
-import re
-import textwrap
+import asyncio
+from collections import OrderedDict
+import os
+import sys
+import tempfile
+import threading
 import time
 
 import datalab
 import datalab.bigquery as bq
 import datalab.storage as gs
+import datalab.utils
 from datalab.bigquery._utils import TableName
 import pandas as pd
 
+from potoo.columnar import ColumnarFrame, ColumnarWriter
+from potoo.pandas import bq_parse_results_url, pd_read_bq
+from potoo.query_ledger import ledger_record
+from potoo.util import peak_rss_bytes
+
 
 def bq_url_for_query(query: bq.QueryJob) -> str:
     return 'https://bigquery.cloud.google.com/results/%s:%s' % (query.results.name.project_id, query.results.job_id)
 
 
-# TODO Unify with potoo.sql_magics.BQMagics.bq (%bq)
+def bq_execute(query: bq.Query, **kwargs) -> bq.QueryJob:
+    """
+    Like query.execute(**kwargs), except on KeyboardInterrupt cancel the job instead of leaving it running (and billing)
+    """
+    job = query.execute_async(**kwargs)
+    try:
+        return job.wait()
+    except KeyboardInterrupt:
+        print(f'Interrupted: cancelling job[{job.id}]...')
+        bq_cancel_job(job)
+        raise
+
+
+def bq_fetch_results(query: bq.QueryJob, start_row=0, max_rows=None, stats=None, **kwargs) -> pd.DataFrame:
+    """
+    Like query.results.to_dataframe(start_row, max_rows), except fetch pages in parallel and decode them with
+    potoo.pandas_io_gbq_par_io, and never fetch pages past max_rows
+    - stats: optional dict to update with the job and fetch stats, for bq_ledger_record
+    - kwargs are passed through to pd_read_bq
+    """
+    return pd_read_bq(
+        None,
+        job_id=query.results.job_id,
+        project_id=query.results.name.project_id,
+        # Read with the credentials that ran the job (its results may not be readable with others), which also skips
+        # the connector's credential lookup and probe job on every call
+        credentials=query._context.credentials,
+        start_index=start_row,
+        max_rows=max_rows,
+        ledger_source=None,  # Callers record the query themselves (with its sql and query time), from stats
+        ledger_stats=stats,
+        rerun_unreadable_job=False,  # Never silently re-run (and re-bill) the job the caller just ran
+        **kwargs,
+    )
+
+
+def bq_cancel_job(job: bq.Job):
+    """
+    Ask BigQuery to cancel a job (best effort: the job may already be done)
+    """
+    api = job._api
+    url = api._ENDPOINT + (api._JOBS_PATH % (job._context.project_id, job.id)) + '/cancel'
+    try:
+        datalab.utils.Http.request(url, method='POST', credentials=api._credentials)
+    except Exception as e:
+        print(f'Failed to cancel job[{job.id}]: {e}')
+
+
+# TODO Unify with potoo.sql_magics.BQMagics.bq (%bq) (they already share bq_execute and bq_fetch_results)
 def bqq(sql: str, max_rows=1000, **kwargs) -> pd.DataFrame:
     """
     e.g. bqq('select 42')
@@ -26,17 +84,44 @@ def bqq(sql: str, max_rows=1000, **kwargs) -> pd.DataFrame:
 
     print('Running query...')
     start_s = time.time()
-    query = bq.Query(sql).execute(dialect='standard', **kwargs)
-    print('[%.0fs, %s]' % (time.time() - start_s, bq_url_for_query(query)))
+    query = bq_execute(bq.Query(sql), dialect='standard', **kwargs)
+    query_s = time.time() - start_s
+    print('[%.0fs, %s]' % (query_s, bq_url_for_query(query)))
 
     print('Fetching results...')
     start_s = time.time()
-    df = query.results.to_dataframe(max_rows=max_rows)
-    print('[%.0fs]' % (time.time() - start_s))
+    stats = {}
+    df = bq_fetch_results(query, max_rows=max_rows, stats=stats)
+    fetch_s = time.time() - start_s
+    print('[%.0fs]' % fetch_s)
 
+    bq_ledger_record('bqq', sql, query, query_s, fetch_s, df, stats)
     return df
 
 
+def bq_ledger_record(source: str, sql: str, query: bq.QueryJob, query_s: float, fetch_s: float, df: pd.DataFrame,
+                     stats: dict = None):
+    """
+    Record a datalab query in potoo.query_ledger
+    - stats: the fetch's stats from bq_fetch_results (job timings, slot_ms, bytes_billed, pages, decode times), where
+      what we measured here (e.g. query_s, which the fetch didn't see) takes precedence
+    """
+    row = dict(stats or {})
+    row.update({k: v for k, v in dict(
+        source=source,
+        sql=sql,
+        project_id=query.results.name.project_id,
+        job_id=query.results.job_id,
+        bytes_processed=getattr(query, 'bytes_processed', None),
+        cache_hit=getattr(query, 'cache_hit', None),
+        query_s=query_s,
+        fetch_s=fetch_s,
+        rows=len(df),
+        peak_rss_bytes=peak_rss_bytes(),
+    ).items() if v is not None})
+    ledger_record(**row)
+
+
 def bqq_from_url(
     bq_url: str,
     context: datalab.context.Context = None,
@@ -45,42 +130,195 @@ def bqq_from_url(
     """
     e.g. bqq_from_url('https://bigquery.cloud.google.com/results/dwh-v2:bquijob_41b598ad_1614361c9a6')
     """
-    (project_id, job_id) = re.match('^https://bigquery.cloud.google.com/results/(.*?):(.*)$', bq_url).groups()
-    return bqq_from_job_id(job_id, context, **kwargs)
+    parsed = bq_parse_results_url(bq_url)
+    if parsed is None:
+        raise ValueError(f'Not a bq results url: {bq_url}')
+    (project_id, job_id) = parsed
+    return bqq_from_job_id(job_id, context, project_id=project_id, **kwargs)
 
 
 def bqq_from_job_id(
     job_id: str,
     context: datalab.context.Context = None,
+    project_id: str = None,
+    max_rows=1000,
     **kwargs,
 ) -> pd.DataFrame:
     """
     e.g. bqq_from_job_id('bquijob_41b598ad_1614361c9a6')
+    - max_rows: like bqq, only read this many rows (None for all)
+    - kwargs are passed through to pd_read_bq
     """
-    context = context or datalab.context.Context.default()
-    job = bq.Job(job_id, context)
-    job_data = job._api.jobs_get(job.id)
-    sql = job_data['configuration']['query']['query']
-    print(f'Running job_id[{job_id}] with sql[\n{textwrap.indent(sql, prefix="  ")}\n]...')
-    # Have to re-run query since tmp tables that hold job results aren't shared to other users
+    project_id = project_id or (context or datalab.context.Context.default()).project_id
+    print(f'Reading results of job_id[{job_id}]...')
+    # Read the job's results directly (e.g. for your own jobs), which only re-runs the job's sql if the results aren't
+    # readable, since tmp tables that hold job results aren't shared to other users
     #   - e.g. if you open someone else's bq job url in the web ui, you see no results and have to click "Run Query"
-    return bqq(sql, **kwargs)
+    return pd_read_bq(None, job_id=job_id, project_id=project_id, max_rows=max_rows, **kwargs)
+
+
+class ResultHistory:
+    """
+    Indexed history of query results, keeping at most max_bytes of frames in memory: older frames are evicted to
+    columnar files in spill_dir (see potoo.columnar) and read back (memory-mapped) when recalled
+
+    Example usage:
+        history[3]  # Result of query 3
+        history     # Summary of all queries
+    """
+
+    def __init__(self, max_bytes=1024**3, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir  # None means a new temp dir, on first eviction
+        self._entries = OrderedDict()  # i -> dict(sql, status, df, frame, n_bytes, error, start_s, elapsed_s)
+        self._lock = threading.Lock()
 
+    def submit(self, sql: str) -> int:
+        with self._lock:
+            i = len(self._entries)
+            self._entries[i] = dict(
+                sql=sql, status='running', df=None, frame=None, n_bytes=0, error=None, start_s=time.time(),
+                elapsed_s=None,
+            )
+            return i
 
-def bqi():
+    def put(self, i: int, df: pd.DataFrame = None, error: Exception = None):
+        with self._lock:
+            entry = self._entries[i]
+            entry.update(
+                status='failed' if error is not None else 'done',
+                df=df,
+                error=error,
+                n_bytes=0 if df is None else int(df.memory_usage(deep=True).sum()),
+                elapsed_s=time.time() - entry['start_s'],
+            )
+            self._evict(keep_i=i)
+
+    def _evict(self, keep_i: int):
+        # Evict oldest first, but always keep the result that just arrived in memory
+        in_memory = [(i, entry) for i, entry in self._entries.items() if entry['df'] is not None and i != keep_i]
+        n_bytes = sum(entry['n_bytes'] for entry in self._entries.values() if entry['df'] is not None)
+        for i, entry in in_memory:
+            if n_bytes <= self.max_bytes:
+                break
+            try:
+                entry['frame'] = self._spill(i, entry['df'])
+            except Exception as e:
+                print(f'[{i}] Failed to evict result to disk, keeping it in memory: {e}')
+                continue
+            entry['df'] = None
+            n_bytes -= entry['n_bytes']
+
+    def _spill(self, i: int, df: pd.DataFrame) -> ColumnarFrame:
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='potoo-bqi-')
+        writer = ColumnarWriter(os.path.join(self.spill_dir, 'result-%d.parquet' % i))
+        writer.write(df)
+        return writer.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, i: int) -> pd.DataFrame:
+        with self._lock:
+            entry = self._entries[i]
+            if entry['error'] is not None:
+                raise entry['error']
+            elif entry['frame'] is not None:
+                return entry['frame'].to_pandas()
+            else:
+                return entry['df']  # None if still running
+
+    def last(self) -> pd.DataFrame:
+        """Most recently submitted result that's done"""
+        done = [i for i, entry in self._entries.items() if entry['status'] == 'done']
+        return self[done[-1]] if done else None
+
+    def summary(self) -> pd.DataFrame:
+        with self._lock:
+            return pd.DataFrame([
+                OrderedDict([
+                    ('i', i),
+                    ('status', entry['status']),
+                    ('where', 'disk' if entry['frame'] is not None else 'memory' if entry['df'] is not None else None),
+                    ('n_bytes', entry['n_bytes']),
+                    ('elapsed_s', entry['elapsed_s']),
+                    ('sql', ' '.join(entry['sql'].split())[:80]),
+                ])
+                for i, entry in self._entries.items()
+            ]).set_index('i')
+
+    def __repr__(self):
+        return repr(self.summary()) if self._entries else 'ResultHistory([])'
+
+
+def bqi(max_bytes=1024**3, spill_dir=None, progress_s=10, **kwargs) -> ResultHistory:
+    """
+    Interactive bqq on stdin: each query (terminated by a blank line) runs in the background, so you can type the next
+    query while it runs, and each result is kept in a ResultHistory (returned at EOF)
+    - Blank line: print the last result
+    - ':': print the history
+    - ':3': print result 3
+    - kwargs are passed through to bqq
+    """
+    history = ResultHistory(max_bytes=max_bytes, spill_dir=spill_dir)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_bqi(loop, history, progress_s, kwargs))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+    return history
+
+
+async def _bqi(loop, history: ResultHistory, progress_s: float, bqq_kwargs: dict):
     next_query = ''
-    last_df = None
-    for line in sys.stdin:
-        if line.strip():
+    tasks = []
+    while True:
+        # Read stdin on a thread, so queries keep running (and reporting progress) while we wait for input
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:  # EOF
+            break
+        elif line.startswith(':') and not next_query.strip():
+            _bqi_command(history, line[1:].strip())
+        elif line.strip():
             next_query += line
         elif next_query.strip():
-            try:
-                last_df = bqq(next_query)
-                print(last_df)
-            except Exception as e:
-                print(e)
+            i = history.submit(next_query)
+            print(f'[{i}] Submitted')
+            tasks.append(loop.create_task(_bqi_run(loop, history, i, next_query, progress_s, bqq_kwargs)))
             next_query = ''
-            print()
         else:
-            print(last_df)
+            print(history.last())
             print()
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def _bqi_run(loop, history: ResultHistory, i: int, sql: str, progress_s: float, bqq_kwargs: dict):
+    start_s = time.time()
+    future = loop.run_in_executor(None, lambda: bqq(sql, **bqq_kwargs))
+    while not (await asyncio.wait([future], timeout=progress_s))[0]:
+        print(f'[{i}] Running... [{time.time() - start_s:.0f}s]')
+    try:
+        df = future.result()
+    except Exception as e:
+        history.put(i, error=e)
+        print(f'[{i}] Failed: {e}')
+    else:
+        history.put(i, df)
+        print(f'[{i}] Done: {len(df)} rows [{time.time() - start_s:.0f}s] (print with :{i})')
+
+
+def _bqi_command(history: ResultHistory, arg: str):
+    if not arg:
+        print(history)
+    elif arg.isdigit():
+        try:
+            print(history[int(arg)])
+        except Exception as e:
+            print(f'[{arg}] {type(e).__name__}: {e}')
+    else:
+        print(f"Unknown command[:{arg}]: try ':' (history) or ':<i>' (result i)")
+    print()
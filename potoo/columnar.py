@@ -0,0 +1,133 @@
+"""
+On-disk columnar frames (parquet, via pyarrow), for results too big to keep in memory as one pd.DataFrame
+
+Example usage:
+    writer = ColumnarWriter('x.parquet')  # Or 'dir/' for one part file per page
+    for df in pages:
+        writer.write(df)
+    cf = writer.close()
+    cf['some_col']  # Reads (memory-maps) just that column
+"""
+
+import os
+
+import pandas as pd
+
+
+def _pyarrow():
+    # pyarrow is optional: only required if you actually write/read columnar files
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('Columnar files require pyarrow: {0}'.format(e))
+    return pa, pq
+
+
+def _is_dir_path(path: str) -> bool:
+    return path.endswith('/') or os.path.isdir(path)
+
+
+class ColumnarWriter:
+    """
+    Append frames to path as they arrive, holding at most one frame in memory at a time
+    - path ending in '/' (or an existing dir): one part-NNNNN.parquet file per frame (existing part files are removed
+      first, so a re-run with fewer frames doesn't leave stale parts behind)
+    - else: a single parquet file, one row group per frame
+
+    types maps column names to pyarrow type aliases (e.g. {'x': 'int64'}), to pin down the file schema when the first
+    frame can't (e.g. a column that's all null in the first page but not in later ones).
+    """
+
+    def __init__(self, path: str, types: dict = None):
+        self.path = path
+        self.types = types or {}
+        self.is_dir = _is_dir_path(path)
+        self.n_frames = 0
+        self.n_rows = 0
+        self._schema = None
+        self._writer = None
+        if self.is_dir:
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                if name.startswith('part-') and name.endswith('.parquet'):
+                    os.remove(os.path.join(path, name))
+
+    def write(self, df: pd.DataFrame):
+        pa, pq = _pyarrow()
+        if self._schema is None:
+            inferred = pa.Table.from_pandas(df, preserve_index=False).schema
+            self._schema = pa.schema([
+                pa.field(field.name, pa.type_for_alias(self.types[field.name]))
+                if field.name in self.types else field
+                for field in inferred
+            ])
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self.is_dir:
+            pq.write_table(table, os.path.join(self.path, 'part-%05d.parquet' % self.n_frames))
+        else:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table)
+        self.n_frames += 1
+        self.n_rows += len(df)
+
+    def close(self) -> 'ColumnarFrame':
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return ColumnarFrame(self.path)
+
+
+class ColumnarFrame:
+    """
+    Lazy handle to a columnar file (or dir of part files): nothing is read until you ask for columns, and then only
+    those columns are read (memory-mapped)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _part_paths(self) -> list:
+        if _is_dir_path(self.path):
+            return sorted(
+                os.path.join(self.path, name)
+                for name in os.listdir(self.path)
+                if name.endswith('.parquet')
+            )
+        else:
+            return [self.path]
+
+    @property
+    def columns(self) -> list:
+        pa, pq = _pyarrow()
+        [part_path, *_] = self._part_paths()
+        return pq.ParquetFile(part_path, memory_map=True).schema.names
+
+    def __len__(self) -> int:
+        pa, pq = _pyarrow()
+        return sum(pq.ParquetFile(part_path, memory_map=True).metadata.num_rows for part_path in self._part_paths())
+
+    def to_pandas(self, columns: list = None) -> pd.DataFrame:
+        pa, pq = _pyarrow()
+        return pq.read_table(self.path, columns=columns, memory_map=True).to_pandas()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.to_pandas(columns=[key])[key]
+        else:
+            return self.to_pandas(columns=list(key))
+
+    def head(self, n=5) -> pd.DataFrame:
+        pa, pq = _pyarrow()
+        dfs = []
+        for part_path in self._part_paths():
+            f = pq.ParquetFile(part_path, memory_map=True)
+            for i in range(f.num_row_groups):
+                dfs.append(f.read_row_group(i).to_pandas())
+                if sum(map(len, dfs)) >= n:
+                    return pd.concat(dfs, ignore_index=True).head(n)
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=self.columns)
+
+    def __repr__(self):
+        return 'ColumnarFrame(%r, rows=%s, columns=%s)' % (self.path, len(self), self.columns)
@@ -1,9 +1,14 @@
+import configparser
 from contextlib import contextmanager
+import io
 import os
+import re
 import signal
 import subprocess
 import sys
+import threading
 import types
+import uuid
 
 import pandas as pd
 
@@ -119,14 +124,369 @@ def pd_flatmap(df, f):
 
 
 # TODO What's the right way to manage sessions and txns?
-def pd_read_sql(session, sql):
+def pd_read_sql(session, sql, copy=False, cache=False, refresh=False, cache_ttl_s='default', cache_marker=None,
+                partition_on=None, partitions=None):
+    """
+    - copy: for postgres, read via COPY instead of row by row (see pd_read_sql_copy); ignored for other dbs
+    - partition_on, partitions: read in parallel partitions over pooled connections (see pd_read_sql_partitioned)
+    - cache: reuse results cached on disk for the same sql + db (see potoo.sql_cache for refresh, cache_ttl_s,
+      cache_marker)
+    """
+    if cache:
+        from potoo.sql_cache import sql_cache_read
+        return sql_cache_read(
+            session.bind.url, sql,
+            read=lambda: pd_read_sql(session, sql, copy=copy, partition_on=partition_on, partitions=partitions),
+            ttl_s=cache_ttl_s,
+            marker=cache_marker,
+            refresh=refresh,
+        )
+
+    if partitions is not None:
+        if partition_on is None:
+            raise ValueError('partitions requires partition_on')
+        copy = copy and session.bind.dialect.name == 'postgresql'
+        return pd_read_sql_partitioned(session.bind, sql, partition_on, partitions, copy=copy)
+
     session.rollback()
     try:
-        return pd.read_sql(sql, session.connection())
+        con = session.connection()
+        if copy and con.dialect.name == 'postgresql':
+            return pd_read_sql_copy(con, sql)
+        else:
+            return pd.read_sql(sql, con)
     finally:
         session.rollback()
 
 
+# Postgres type oids, to type the columns of pd_read_sql_copy (all other types are read as str)
+_pg_int_oids = {20, 21, 23}  # int8, int2, int4
+_pg_float_oids = {700, 701, 1700}  # float4, float8, numeric
+_pg_bool_oids = {16}
+_pg_date_oids = {1082, 1114, 1184}  # date, timestamp, timestamptz
+
+
+def pd_read_sql_copy(con, sql: str, params=None) -> pd.DataFrame:
+    """
+    Read postgres query results via `COPY (sql) TO STDOUT` as csv, streamed through a pipe into pd.read_csv's
+    vectorized parser, instead of building a python tuple per row through the dbapi driver -- several times faster for
+    big results. Columns are typed from the query's result description.
+    - con: sqla engine or connection (to a postgres db, via psycopg2)
+    - params: bound client-side (via cursor.mogrify), since COPY can't take server-side params
+    """
+
+    with con.connect() as conn:
+        cursor = conn.connection.cursor()  # Raw dbapi (psycopg2) cursor
+        try:
+            if params is not None:
+                sql = cursor.mogrify(sql, params).decode()
+            sql = sql.strip().rstrip(';')
+
+            # Get the result description without running the query
+            cursor.execute('select * from (%s) _ limit 0' % sql)
+            oids = [(col.name, col.type_code) for col in cursor.description]
+            dtype = {}
+            for name, oid in oids:
+                if oid in _pg_float_oids:
+                    dtype[name] = 'float64'
+                elif not (oid in _pg_int_oids or oid in _pg_bool_oids or oid in _pg_date_oids):
+                    dtype[name] = str  # Don't let read_csv infer types for e.g. '007' or 'NA'
+
+            # Write COPY's output into a pipe from a thread while read_csv parses it, so the raw csv is never buffered
+            error_ref = {'error': None}  # Mutable ref cell to share across functions calls
+            r_fd, w_fd = os.pipe()
+
+            def copy():
+                try:
+                    with os.fdopen(w_fd, 'wb') as w:
+                        cursor.copy_expert("COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER, NULL '\\N')" % sql, w)
+                except Exception as e:
+                    error_ref['error'] = e
+
+            thread = threading.Thread(target=copy, daemon=True)
+            thread.start()
+            try:
+                with os.fdopen(r_fd, 'rb') as r:
+                    df = pd.read_csv(
+                        r,
+                        dtype=dtype,
+                        parse_dates=[name for name, oid in oids if oid in _pg_date_oids],
+                        true_values=['t'],
+                        false_values=['f'],
+                        na_values=['\\N'],
+                        keep_default_na=False,  # Only \N is null; '' and 'NA' are strings
+                    )
+            except Exception:
+                if error_ref['error'] is None:
+                    raise
+            finally:
+                thread.join()
+            if error_ref['error'] is not None:
+                raise error_ref['error']  # e.g. an error in sql, which makes read_csv fail on an empty pipe
+            return df
+
+        finally:
+            cursor.close()
+
+
+def pd_read_sql_partitioned(con, sql: str, partition_on: str, partitions: int, copy=False,
+                            on_cancel=None) -> pd.DataFrame:
+    """
+    Read sql as `partitions` disjoint range-restricted copies of itself (on partition_on, e.g. an id or timestamp
+    column), run concurrently each on its own pooled connection -- so both the db (one backend per connection) and the
+    client (one socket and parser per connection) work in parallel -- and concat their results in order
+    - Ranges split partition_on's [min, max] evenly, with the first and last ranges open-ended and nulls in the first
+    - con: sqla engine; at most as many partitions run at once as its pool has connections to spare (pool_size +
+      max_overflow, less those already checked out and one kept free for cancels), and the rest wait their turn
+    - copy: read each partition via pd_read_sql_copy (postgres)
+    - on_cancel: optional hook registrar (e.g. SqlaQuery.on_cancel), called with a function that cancels all the
+      partitions' queries on the server. They're also cancelled if any partition fails, or on Ctrl-C
+    """
+    import dask
+    import sqlalchemy as sqla
+    from potoo.sqlalchemy import QueryCancelled, SqlaQuery
+
+    sql = sql.strip().rstrip(';')
+    with con.connect() as conn:
+        [lo, hi] = conn.execute(sqla.text('select min({0}), max({0}) from ({1}) _'.format(partition_on, sql))).first()
+
+    bounds = [None] + _partition_cuts(lo, hi, partitions) + [None]
+
+    # Bind the cut points as params (in the driver's own param style for copy, since COPY is bound client-side)
+    param = (lambda name: '%%(%s)s' % name) if copy else (lambda name: ':' + name)
+    parts = []
+    for i, (a, b) in enumerate(zip(bounds, bounds[1:])):
+        conds = (
+            ([f'{partition_on} >= {param("partition_lo")}'] if a is not None else []) +
+            ([f'{partition_on} < {param("partition_hi")}'] if b is not None else [])
+        )
+        cond = ' and '.join(conds) or 'true'
+        if i == 0 and a is None and b is not None:
+            cond = f'({cond}) or {partition_on} is null'
+        parts.append((
+            'select * from ({0}) _ where {1}'.format(sql.replace('%', '%%') if copy else sql, cond),
+            {k: v for k, v in [('partition_lo', a), ('partition_hi', b)] if v is not None},
+        ))
+
+    def read(part_sql, params, conn):
+        if copy:
+            return pd_read_sql_copy(conn, part_sql, params)
+        else:
+            return pd.read_sql(sqla.text(part_sql), conn, params=params)
+
+    # Run each partition as a SqlaQuery, which records its connection's backend pid, so cancel_all can cancel them all
+    queries = []
+    cancelled = threading.Event()
+
+    def cancel_all():
+        cancelled.set()
+        for query in list(queries):
+            query.cancel()
+
+    def read_part(part_sql, params):
+        if cancelled.is_set():
+            raise QueryCancelled('Cancelled before it started')
+        query = SqlaQuery(con, lambda conn, progress: read(part_sql, params, conn))
+        queries.append(query)
+        if cancelled.is_set():  # Cancelled after cancel_all copied queries
+            query.cancel()
+        return query.result()
+
+    # Don't run more partitions at once than the pool can serve, else the rest time out waiting for a connection, and
+    # leave one connection free for SqlaQuery.cancel's pg_cancel_backend, else cancels wait out the pool timeout
+    pool = con.pool
+    if isinstance(pool, sqla.pool.QueuePool) and pool._max_overflow >= 0:  # max_overflow=-1 means no limit
+        num_workers = max(1, min(len(parts), pool.size() + pool._max_overflow - pool.checkedout() - 1))
+    else:
+        num_workers = len(parts)
+
+    if on_cancel is not None:
+        on_cancel(cancel_all)
+    try:
+        dfs = dask.delayed(list)([
+            dask.delayed(read_part)(part_sql, params)
+            for part_sql, params in parts
+        ]).compute(
+            get=dask.threaded.get,
+            num_workers=num_workers,
+        )
+    except BaseException:
+        cancel_all()
+        raise
+    return pd.concat(dfs, ignore_index=True)
+
+
+def _partition_cuts(lo, hi, partitions) -> list:
+    """
+    Cut points that split [lo, hi] into (at most) partitions evenly sized ranges (lo None, i.e. all null: no cuts)
+
+    >>> _partition_cuts(0, 99, 4)
+    [25, 50, 75]
+    >>> _partition_cuts(1, 2, 4)  # Fewer values than partitions
+    [2]
+    >>> _partition_cuts(0., 1., 4)
+    [0.25, 0.5, 0.75]
+    >>> import datetime
+    >>> _partition_cuts(datetime.date(2018, 1, 1), datetime.date(2018, 1, 31), 3)
+    [datetime.date(2018, 1, 11), datetime.date(2018, 1, 21)]
+    >>> _partition_cuts(None, None, 4)
+    []
+    >>> _partition_cuts('a', 'z', 2)
+    Traceback (most recent call last):
+      ...
+    ValueError: Can only partition on numeric, date or time columns, not str
+    """
+    if lo is None or partitions <= 1:
+        return []
+    elif isinstance(lo, int):
+        return sorted({lo + (hi - lo + 1) * k // partitions for k in range(1, partitions)} - {lo})
+    else:
+        try:
+            return sorted({lo + (hi - lo) * k / partitions for k in range(1, partitions)} - {lo})
+        except TypeError:
+            raise ValueError(f'Can only partition on numeric, date or time columns, not {type(lo).__name__}')
+
+
+def pd_read_sql_chunks(con, sql, chunksize, on_types=None, coerce_float=True):
+    """
+    Stream sql results as dfs of (at most) chunksize rows, via a server-side cursor (stream_results), so neither the
+    driver nor pandas ever holds the whole result
+    - con: sqla engine or connection
+    - on_types: optional callback, called before the first chunk with the result's column types as pyarrow type aliases
+      (from the cursor description; only known for postgres, else {}), for consumers like ColumnarWriter that can't
+      infer a stable schema from any one chunk (e.g. a column that's all null in the first chunk)
+    """
+    with con.connect() as conn:
+        conn = conn.execution_options(stream_results=True)  # e.g. named cursors in psycopg2, SSCursor in mysql
+        result = conn.execute(sql)
+        try:
+            if on_types is not None:
+                on_types(_sql_arrow_types(conn.dialect.name, result.cursor.description or []))
+            columns = result.keys()
+            while True:
+                rows = result.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=coerce_float)
+        finally:
+            result.close()
+
+
+_pg_arrow_types = {
+    **{oid: 'int64' for oid in _pg_int_oids},
+    **{oid: 'float64' for oid in _pg_float_oids},  # numeric too, since we coerce_float
+    **{oid: 'bool' for oid in _pg_bool_oids},
+    1082: 'date32',
+    1114: 'timestamp[us]',
+    **{oid: 'string' for oid in [25, 1042, 1043]},  # text, bpchar, varchar
+}
+
+
+def _sql_arrow_types(dialect_name: str, description: list) -> dict:
+    if dialect_name != 'postgresql':
+        return {}
+    return {
+        name: _pg_arrow_types[oid]
+        for name, oid, *_ in description
+        if oid in _pg_arrow_types
+    }
+
+
+def pd_write_sql(session, df, table, method='copy', if_exists='fail', schema=None, staging=False, chunksize=100000):
+    """
+    Write df to table, much faster than df.to_sql for big dfs: for postgres, stream df into `COPY ... FROM STDIN` as
+    csv, chunksize rows at a time (so memory stays bounded). Other dbs (or method='insert') fall back to df.to_sql.
+    - if_exists: 'fail', 'replace' or 'append' (like df.to_sql)
+    - staging: load into a staging table, then swap it in (replace) or insert from it (append), so the target table is
+      only locked for that last step instead of for the whole load. When appending, the staging table is unlogged (to
+      skip the wal while loading); when replacing it isn't, since making an unlogged table logged rewrites all of it
+      into the wal anyway
+    - Runs in one transaction on session's engine (sqla_session sessions autocommit, so there's no session transaction
+      to join), so the table changes all at once or not at all
+    """
+
+    if method not in ('copy', 'insert'):
+        raise ValueError(f"method[{method}] must be 'copy' or 'insert'")
+    if if_exists not in ('fail', 'replace', 'append'):
+        raise ValueError(f"if_exists[{if_exists}] must be 'fail', 'replace' or 'append'")
+
+    with session.bind.begin() as conn:
+
+        if method == 'insert' or conn.dialect.name != 'postgresql':
+            df.to_sql(table, conn, schema=schema, if_exists=if_exists, index=False, chunksize=chunksize)
+            return
+
+        quote = conn.dialect.identifier_preparer.quote
+        qualify = lambda name: '.'.join(quote(x) for x in [schema, name] if x)
+        columns = ', '.join(quote(str(col)) for col in df.columns)
+        exists = conn.dialect.has_table(conn, table, schema=schema)
+        if exists and if_exists == 'fail':
+            raise ValueError(f'Table[{qualify(table)}] already exists')
+
+        # Create the table to load into
+        append_staged = staging and exists and if_exists == 'append'
+        load_table = '%s__staging_%s' % (table[:40], uuid.uuid4().hex[:8]) if staging else table  # <63 chars
+        if append_staged:
+            conn.execute('create unlogged table %s (like %s)' % (qualify(load_table), qualify(table)))
+        elif staging or not (exists and if_exists == 'append'):
+            _pg_create_table(conn, df, load_table, qualify(load_table), schema, 'fail' if staging else 'replace')
+
+        _pg_copy_from(conn, df, qualify(load_table), columns, chunksize)
+
+        if staging:
+            if append_staged:
+                conn.execute('insert into %s (%s) select %s from %s' % (
+                    qualify(table), columns, columns, qualify(load_table),
+                ))
+                conn.execute('drop table %s' % qualify(load_table))
+            else:
+                if exists:
+                    conn.execute('drop table %s' % qualify(table))
+                conn.execute('alter table %s rename to %s' % (qualify(load_table), quote(table)))
+
+
+def _pg_create_table(conn, df, table, qualified_table, schema, if_exists):
+    # Create table with column types from df's values, like df.to_sql, but without inserting df: to_sql a sample with
+    # each column's first non-null value, then truncate. (df.head(0).to_sql would type object columns, e.g. dates,
+    # decimals and nullable bools, as text, since it has no values to infer from)
+    sample = df.iloc[sorted(set(df.notnull().values.argmax(axis=0)))] if len(df) else df
+    sample.to_sql(table, conn, schema=schema, if_exists=if_exists, index=False)
+    conn.execute('truncate %s' % qualified_table)
+
+
+def _pg_copy_from(conn, df, qualified_table, columns, chunksize):
+    cursor = conn.connection.cursor()  # Raw dbapi (psycopg2) cursor, in conn's transaction
+    try:
+        sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')" % (qualified_table, columns)
+        for start in range(0, len(df), chunksize):
+            csv = io.StringIO()
+            _pg_integral_floats_as_ints(df.iloc[start:start + chunksize]).to_csv(
+                csv, index=False, header=False, na_rep='\\N',
+            )
+            csv.seek(0)
+            cursor.copy_expert(sql, csv)
+    finally:
+        cursor.close()
+
+
+def _pg_integral_floats_as_ints(df):
+    # Write float columns with only integral values (e.g. ints with nulls, which pandas stores as float) as ints, since
+    # COPY rejects '1.0' for integer columns (whereas INSERT casts it), and '1' is still fine for float columns
+    integral = {
+        j for j, dtype in enumerate(df.dtypes)
+        if dtype.kind == 'f' and (df.iloc[:, j].dropna() % 1 == 0).all()
+    }
+    if not integral:
+        return df
+    as_ints = lambda col: pd.Series(  # dtype=object, else pandas converts the ints right back to floats
+        [None if x != x else int(x) for x in col], index=col.index, name=col.name, dtype=object,
+    )
+    return pd.concat(axis=1, objs=[
+        as_ints(df.iloc[:, j]) if j in integral else df.iloc[:, j]
+        for j in range(len(df.columns))
+    ])
+
+
 # TODO -> potoo.sqlalchemy
 def raw_sql(session, sql):
     return (dict(x.items()) for x in session.execute(sql))
@@ -165,7 +525,63 @@ def pd_read_bq(
     )
 
 
+def bq_parse_results_url(url: str) -> (str, str):
+    """
+    (project_id, job_id) from a bq web ui results url, or None if url isn't one
+
+    >>> bq_parse_results_url('https://bigquery.cloud.google.com/results/dwh-v2:bquijob_41b598ad_1614361c9a6')
+    ('dwh-v2', 'bquijob_41b598ad_1614361c9a6')
+    >>> bq_parse_results_url('bquijob_41b598ad_1614361c9a6')
+    """
+    m = re.match(r'^https://bigquery\.cloud\.google\.com/results/(.*?):(.*)$', url)
+    return m.groups() if m else None
+
+
+# (config path, config mtime) -> project, for bq_default_project
+_bq_default_project_cache = {}
+
+
 def bq_default_project():
+    """
+    Same as `gcloud config get-value project`, but read from the gcloud env vars and config files directly -- and
+    cached until the config file changes -- since each gcloud subprocess costs ~100s of ms of python startup. Only
+    shells out to gcloud if the config files don't say.
+    """
+
+    project = os.environ.get('CLOUDSDK_CORE_PROJECT')
+    if project:
+        return project
+
+    config_dir = os.environ.get('CLOUDSDK_CONFIG') or os.path.expanduser('~/.config/gcloud')
+    config_name = os.environ.get('CLOUDSDK_ACTIVE_CONFIG_NAME')
+    if not config_name:
+        try:
+            with open(os.path.join(config_dir, 'active_config')) as f:
+                config_name = f.read().strip()
+        except OSError:
+            pass
+    config_path = os.path.join(config_dir, 'configurations', 'config_%s' % (config_name or 'default'))
+    try:
+        config_mtime = os.stat(config_path).st_mtime
+    except OSError:
+        config_mtime = None
+
+    key = (config_path, config_mtime)
+    if key not in _bq_default_project_cache:
+        project = None
+        if config_mtime is not None:
+            config = configparser.ConfigParser()
+            try:
+                config.read(config_path)
+                project = config.get('core', 'project', fallback=None)
+            except configparser.Error:
+                pass
+        _bq_default_project_cache.clear()
+        _bq_default_project_cache[key] = project or _bq_default_project_gcloud()
+    return _bq_default_project_cache[key]
+
+
+def _bq_default_project_gcloud():
     return subprocess.check_output(
         'gcloud config get-value project 2>/dev/null',
         shell=True,
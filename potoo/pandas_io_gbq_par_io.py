@@ -9,12 +9,17 @@
 #   - [TODO Add maximumBillingTier (https://cloud.google.com/bigquery/docs/reference/rest/v2/jobs)]
 #   - Added parallel fetching of query results to make that faster over high-latency connections (hacked in dask for par IO)
 
+from array import array
 import warnings
-from datetime import datetime
+from datetime import date, datetime
 import json
+import importlib
 import logging
+import multiprocessing
+import re
 from time import sleep
 import uuid
+import threading
 import time
 import sys
 
@@ -23,11 +28,12 @@ import numpy as np
 from collections import OrderedDict
 from distutils.version import StrictVersion
 from pandas import compat
-from pandas.core.api import DataFrame
-from pandas.tools.merge import concat
+from pandas.core.api import Categorical, DataFrame
 from pandas.core.common import PandasError
 from pandas.compat import lzip, bytes_to_str
 
+from potoo.util import peak_rss_bytes
+
 
 def _check_google_client_version():
 
@@ -157,7 +163,8 @@ class GbqConnector(object):
     scope = 'https://www.googleapis.com/auth/bigquery'
 
     def __init__(self, project_id, reauth=False, verbose=False,
-                 private_key=None, dialect='legacy', use_query_cache=True):
+                 private_key=None, dialect='legacy', use_query_cache=True,
+                 memory_budget=None, json_decoder=None, credentials=None):
         _check_google_client_version()
         _test_google_api_imports()
         self.project_id = project_id
@@ -166,7 +173,19 @@ class GbqConnector(object):
         self.private_key = private_key
         self.dialect = dialect
         self.use_query_cache = use_query_cache
-        self.credentials = self.get_credentials()
+        self.memory_budget = memory_budget  # Bytes of pages in flight + buffered, when pages are consumed via on_page
+        self.json_loads = _resolve_json_loads(json_decoder)
+        self._json_decode_s = 0
+        self._json_decode_lock = threading.Lock()
+        self.total_rows = None  # Set by run_query, once the job completes
+        self.stats = {}  # Set by run_query, for potoo.query_ledger
+        self.ledger_source = 'read_gbq'
+        self.rerun_unreadable_job = True  # Else run_query(job_id=...) raises if the job's results aren't readable
+        self.ledger_stats = None  # Dict to also update with record_ledger's stats (e.g. when ledger_source is None)
+        self._cancelled = threading.Event()
+        self._inserted_job_reference = None  # The job run_query is running (not existing jobs it only reads from)
+        # Given credentials (e.g. a datalab context's) skip the lookup, and its probe job
+        self.credentials = credentials or self.get_credentials()
         self.service = self.get_service()
 
     def get_credentials(self):
@@ -388,20 +407,127 @@ class GbqConnector(object):
 
         raise StreamingInsertError
 
-    def run_query(self, query, max_results):
+    def run_query(self, query, max_results, on_page=None, job_id=None, start_index=0, max_rows=None):
+        """
+        Run query and fetch all result pages in parallel (or only result rows [start_index, start_index + max_rows))
+
+        If on_page is given, each page is passed to on_page(schema, rows) as soon as it (and all pages before it) has
+        arrived, instead of being collected into the returned list of pages -- e.g. to decode pages straight to disk.
+
+        If job_id is given, read the results of that existing job instead of running query, and fall back to re-running
+        the job's own query only if its results aren't readable (e.g. expired, or someone else's job, since the temp
+        tables that hold job results aren't shared). Readability is probed before any page is read, so a fallback never
+        re-delivers pages to on_page, and errors mid-fetch (e.g. transient ones) are raised instead of re-running (and
+        re-billing) the query. Unless rerun_unreadable_job is False, in which case unreadable results raise too.
+
+        On KeyboardInterrupt, cancel the job (so it stops running and billing), stop the page workers, and release
+        buffered pages before re-raising.
+        """
+
+        if job_id is not None:
+            unreadable_reason = self.job_results_unreadable_reason(job_id)
+            if unreadable_reason is None:
+                return self._run_query_interruptible(None, max_results, on_page, start_index, max_rows, job_id=job_id)
+            if not self.rerun_unreadable_job:
+                raise GenericGBQException('Results of job[{}] not readable ({})'.format(job_id, unreadable_reason))
+            query = self.get_job_query(job_id)
+            self._print('Results of job[{}] not readable ({}), re-running its query...'.format(
+                job_id, unreadable_reason,
+            ))
+
+        return self._run_query_interruptible(query, max_results, on_page, start_index, max_rows)
+
+    def job_results_unreadable_reason(self, job_id):
+        """
+        Probe an existing job's results without reading any rows (maxResults=0): the error reason if they're gone or not
+        ours (notFound, accessDenied), else None. Raises on any other error, since re-running the query wouldn't fix it.
+        """
         try:
             from googleapiclient.errors import HttpError
         except:
             from apiclient.errors import HttpError
-        from oauth2client.client import AccessTokenRefreshError
 
-        # For multithreading, for parallel io. Fail fast if user doesn't have it installed.
-        import dask
+        try:
+            self.service.jobs().getQueryResults(
+                projectId=self.project_id, jobId=job_id, maxResults=0, timeoutMs=0,
+            ).execute()
+        except HttpError as ex:
+            errors = json.loads(bytes_to_str(ex.content))['error'].get('errors') or []
+            for error in errors:
+                if error.get('reason') in ('notFound', 'accessDenied'):
+                    return error['reason']
+            self.process_http_error(ex)
+        return None
+
+    def _run_query_interruptible(self, query, max_results, on_page, start_index=0, max_rows=None, job_id=None):
+
+        # Pick the job id up front so we can cancel the job even if we're interrupted before jobs.insert returns
+        job_reference = {
+            'projectId': self.project_id,
+            'jobId': job_id or 'potoo_{}'.format(uuid.uuid4().hex),
+        }
+        page_buffers = []  # Buffers of fetched pages, to release on interrupt
+        self._cancelled.clear()  # Else a cancel of a previous run_query would truncate this one
+        self._inserted_job_reference = job_reference if job_id is None else None
+
+        try:
+            return self._run_query(query, max_results, on_page, start_index, max_rows, job_reference, page_buffers,
+                                   insert=job_id is None)
+        except KeyboardInterrupt:
+            pass
+
+        # Clean up and re-raise outside of the except block, so the traceback doesn't keep the fetch frames (and all
+        # their pages) alive, e.g. via ipython's sys.last_traceback
+        self.cancel(cancel_job=True)
+        for page_buffer in page_buffers:
+            page_buffer.clear()
+        raise KeyboardInterrupt
+
+    def get_job_query(self, job_id):
+        """
+        Get an existing job's sql, and adopt its dialect (so the sql can be re-run as is)
+        """
+        try:
+            from googleapiclient.errors import HttpError
+        except:
+            from apiclient.errors import HttpError
+
+        try:
+            job = self.service.jobs().get(projectId=self.project_id, jobId=job_id).execute()
+        except HttpError as ex:
+            self.process_http_error(ex)
+
+        query_config = job['configuration']['query']
+        self.dialect = 'legacy' if query_config.get('useLegacySql', True) else 'standard'
+        return query_config['query']
+
+    def cancel_job(self, job_reference):
+        """
+        Ask BigQuery to cancel a job (best effort: the job may already be done, or not yet exist)
+        """
+        try:
+            # Fresh service, since page workers may still be using self.service
+            self.get_service().jobs().cancel(
+                projectId=job_reference['projectId'],
+                jobId=job_reference['jobId'],
+            ).execute()
+        except Exception as e:
+            self._print('Failed to cancel job[{}]: {}'.format(job_reference['jobId'], e))
+
+    def _run_query(self, query, max_results, on_page, start_index, max_rows, job_reference, page_buffers, insert=True):
+        try:
+            from googleapiclient.errors import HttpError
+        except:
+            from apiclient.errors import HttpError
+        from oauth2client.client import AccessTokenRefreshError
 
         _check_google_client_version()
 
+        self._json_decode_s = 0
+
         job_collection = self.service.jobs()
         job_data = {
+            'jobReference': job_reference,
             'configuration': {
                 'query': {
                     'query': query,
@@ -414,30 +540,44 @@ class GbqConnector(object):
         }
 
         self._start_timer()
-        try:
-            self._print('Requesting query... ', end="")
-            query_reply = job_collection.insert(
-                projectId=self.project_id, body=job_data).execute()
-            self._print('ok.\nQuery running...')
-        except (AccessTokenRefreshError, ValueError):
-            if self.private_key:
-                raise AccessDenied(
-                    "The service account credentials are not valid")
-            else:
-                raise AccessDenied(
-                    "The credentials have been revoked or expired, "
-                    "please re-run the application to re-authorize")
-        except HttpError as ex:
-            self.process_http_error(ex)
+        if insert:
+            try:
+                self._print('Requesting query... ', end="")
+                query_reply = job_collection.insert(
+                    projectId=self.project_id, body=job_data).execute()
+                self._print('ok.\nQuery running...')
+                if self._cancelled.is_set():  # Cancelled (e.g. from another thread) while inserting
+                    raise KeyboardInterrupt
+            except (AccessTokenRefreshError, ValueError):
+                if self.private_key:
+                    raise AccessDenied(
+                        "The service account credentials are not valid")
+                else:
+                    raise AccessDenied(
+                        "The credentials have been revoked or expired, "
+                        "please re-run the application to re-authorize")
+            except HttpError as ex:
+                self.process_http_error(ex)
+        else:
+            # Existing job: read its results (from its destination table) without re-running it
+            self._print('Reading results of job[{}]...'.format(job_reference['jobId']))
+            query_reply = {'jobReference': job_reference}
 
         job_reference = query_reply['jobReference']
 
         while not query_reply.get('jobComplete', False):
+            if self._cancelled.is_set():  # Cancelled from another thread while waiting
+                raise KeyboardInterrupt
             self.print_elapsed_seconds('  Elapsed', 's. Waiting...')
             try:
-                query_reply = job_collection.getQueryResults(
+                query_reply = self._execute_json(job_collection.getQueryResults(
                     projectId=job_reference['projectId'],
-                    jobId=job_reference['jobId']).execute()
+                    jobId=job_reference['jobId'],
+                    # The reply that says the job is done is also the first page, so start it at start_index and
+                    # don't let it run past max_rows
+                    startIndex=start_index,
+                    maxResults=max_rows,
+                ))
             except HttpError as ex:
                 self.process_http_error(ex)
 
@@ -452,51 +592,161 @@ class GbqConnector(object):
 
             self._print('Retrieving results...')
 
+        self.stats = {
+            'sql': query,
+            'project_id': job_reference['projectId'],
+            'job_id': job_reference['jobId'],
+            'cache_hit': query_reply.get('cacheHit'),
+            'bytes_processed': int(query_reply.get('totalBytesProcessed', '0')),
+            'query_s': self.get_elapsed_seconds(),
+        }
+
+        schema = query_reply['schema']  # Only read schema on first page
+        total_rows = int(query_reply['totalRows'])
+
+        def request_page(service, start_index, max_results):
+            return service.jobs().getQueryResults(
+                projectId=job_reference['projectId'],
+                jobId=job_reference['jobId'],
+                startIndex=start_index,
+                maxResults=max_results,  # Limit: 10MB per page
+            )
+
+        start_index = min(start_index, total_rows)
+        end_index = total_rows if max_rows is None else min(total_rows, start_index + max_rows)
+        self.total_rows = end_index - start_index  # Rows we'll read, for progress
+        pages = self._fetch_pages(
+            schema, query_reply.get('rows', []), request_page, start_index, end_index, max_results, on_page,
+            page_buffers,
+        )
+
+        self.stats.update({
+            'fetch_s': self.get_elapsed_seconds() - self.stats['query_s'],
+            'peak_rss_bytes': peak_rss_bytes(),
+            'json_decode_s': self._json_decode_s,
+        })
+        self.record_ledger()
+
+        return schema, pages
+
+    def _fetch_pages(self, schema, page0, request_page, start_index, end_index, max_results, on_page, page_buffers):
+        """
+        Fetch rows [start_index, end_index) in parallel pages, given the rows of the first page (page0) and
+        request_page(service, start_index, max_results) to build the request for any later page. Shared by query
+        results (jobs.getQueryResults) and table reads (tabledata.list), which page the same way.
+
+        Returns the list of pages, or [] if pages were instead passed to on_page(schema, rows) in order.
+        """
+        try:
+            from googleapiclient.errors import HttpError
+        except:
+            from apiclient.errors import HttpError
+        import dask
+
+        self.stats['decode_s'] = 0 if on_page else None
+
+        def consume_page(rows):
+            start_s = time.time()
+            on_page(schema, rows)
+            self.stats['decode_s'] += time.time() - start_s
+
         _print_got_page_progress = {'current_rows': 0}  # Mutable ref cell to share across functions calls
+        # Pages only leave memory when they're consumed via on_page, so the budget only applies then
+        budget = _MemoryBudget(self.memory_budget) if on_page and self.memory_budget else None
+        page_sink = _PageSink(consume_page, budget) if on_page else None
+        if page_sink:
+            page_buffers.append(page_sink._pending)
 
         def print_got_page(page, start_index, max_results, total_rows):
             _print_got_page_progress['current_rows'] += len(page)
             self.print_elapsed_seconds(
-                '  Got max_results[{}] + start_index[{}] -> len_page[{}] + progress[{}/{} = {}%], elapsed'.format(
+                '  Got max_results[{}] + start_index[{}] -> len_page[{}] + progress[{}/{} = {}%]{}, elapsed'.format(
                     max_results,
                     start_index,
                     len(page),
                     _print_got_page_progress['current_rows'],
                     total_rows,
-                    round(100.0 * _print_got_page_progress['current_rows'] / total_rows),
+                    round(100.0 * _print_got_page_progress['current_rows'] / max(total_rows, 1)),
+                    '' if not budget else ' + peak_rss[{}] + buffered[{} / budget {}]'.format(
+                        self.sizeof_fmt(peak_rss_bytes()),
+                        self.sizeof_fmt(budget.used_bytes),
+                        self.sizeof_fmt(budget.budget_bytes),
+                    ),
                 ),
                 overlong=0,
             )
             return page
 
-        def get_page(start_index, max_results, total_rows, **kwargs):
+        def get_page(page_i, start_index, max_results, total_rows, **kwargs):
+
+            # Skip remaining pages once cancelled
+            if self._cancelled.is_set():
+                return None
 
             # Re-init self.service per process (for dask.multiprocessing)
             self.service = self.get_service()
-            job_collection = self.service.jobs()
 
             try:
-                query_reply = job_collection.getQueryResults(
-                    projectId=job_reference['projectId'],
-                    jobId=job_reference['jobId'],
-                    startIndex=start_index,
-                    maxResults=max_results,  # Limit: 10MB per page
-                ).execute()
+                reply = self._execute_json(request_page(self.service, start_index, max_results))
             except HttpError as ex:
                 self.process_http_error(ex)
 
-            return print_got_page(query_reply.get('rows', []), start_index, max_results, total_rows)
+            page = print_got_page(reply.get('rows', []), start_index, max_results, total_rows)
+            if page_sink:
+                if not self._cancelled.is_set():
+                    page_sink.put(page_i, page)
+                return None
+            return page
 
-        schema = query_reply['schema']  # Only read schema on first page
-        total_rows = int(query_reply['totalRows'])
-        page0 = print_got_page(query_reply.get('rows', []), None, None, total_rows)
-        max_results = max_results or len(page0)  # Limit is 10GB per page, so reuse row count from initial page
-        start_indexes = range(max_results, total_rows, max_results)
-
-        pages = [page0]
-        pages += dask.delayed(list)([
-            dask.delayed(get_page)(start_index, max_results, total_rows)
-            for start_index in start_indexes
+        total_rows = end_index - start_index
+        page0 = print_got_page(page0[:total_rows], start_index, None, total_rows)
+        max_results = max_results or max(len(page0), 1)  # Limit is 10MB per page, so reuse row count from initial page
+        # Start after page0 (not at max_results), since page0 can be shorter or longer than max_results
+        start_indexes = range(start_index + len(page0), end_index, max_results)
+        page_bytes = _estimate_bytes_per_row(page0) * max_results
+
+        if page_sink:
+            page_sink.put(0, page0)
+            pages = []
+        else:
+            pages = [page0]
+        page_buffers.append(pages)
+        del page0  # Don't hold onto page0 for the whole fetch if page_sink already consumed it
+
+        # Workers claim pages in ascending order, so the next page that page_sink is waiting on is always already
+        # claimed by some worker -- and it's always let through the budget -- so workers paused on a full budget can't
+        # deadlock waiting on a page that no worker is fetching
+        page_claims = iter(enumerate(start_indexes, 1))
+        page_claims_lock = threading.Lock()
+
+        def fetch_pages(worker_i):
+            fetched = []
+            try:
+                while not self._cancelled.is_set():
+                    with page_claims_lock:
+                        page_i, start_index = next(page_claims, (None, None))
+                    if page_i is None:
+                        break
+                    if budget:
+                        budget.acquire(
+                            page_i,
+                            page_bytes,
+                            can_skip_wait=lambda: page_i == page_sink.next_page_i or self._cancelled.is_set(),
+                        )
+                    # Don't fetch past end_index on the last page
+                    page = get_page(page_i, start_index, min(max_results, end_index - start_index), total_rows)
+                    if page is not None:
+                        fetched.append((page_i, page))
+            except BaseException:
+                # Stop the other workers, else they'd wait on the budget forever (page_sink will never get this
+                # worker's page) or keep fetching pages that no one will read
+                self._cancelled.set()
+                raise
+            return fetched
+
+        fetched = dask.delayed(list)([
+            dask.delayed(fetch_pages)(worker_i)
+            for worker_i in range(min(len(start_indexes), multiprocessing.cpu_count()))
         ]).compute(
             # Single threaded
             # get=dask.async.get_sync,
@@ -504,14 +754,139 @@ class GbqConnector(object):
             #   - https://botbot.me/freenode/python-requests/2016-09-12/?msg=28835010
             get=dask.threaded.get,
         )
+        pages += [page for page_i, page in sorted(
+            (x for worker_fetched in fetched for x in worker_fetched),
+            key=lambda x: x[0],
+        )]
+        del fetched
 
         self.print_elapsed_seconds(
-            'Got {} rows, elapsed'.format(sum([len(page) for page in pages])),
+            'Got {} rows, elapsed'.format(_print_got_page_progress['current_rows']),
             overlong=0,
         )
 
+        self.stats.update({
+            'rows': _print_got_page_progress['current_rows'],
+            'pages': 1 + len(start_indexes),
+        })
+
+        return pages
+
+    def read_table(self, dataset_id, table_id, columns=None, start_index=0, max_rows=None, max_results=None,
+                   on_page=None):
+        """
+        Read rows [start_index, start_index + max_rows) of a table straight from storage via tabledata.list, fetching
+        pages in parallel like run_query -- no query job, so nothing is billed and there's no job to wait on.
+
+        Only columns (top-level fields, default all) are transferred. Returns (schema, pages) like run_query, with
+        schema projected to columns, in table order.
+        """
+        try:
+            from googleapiclient.errors import HttpError
+        except:
+            from apiclient.errors import HttpError
+
+        self._cancelled.clear()  # Else a cancel of a previous read would truncate this one
+        self._json_decode_s = 0
+        self._start_timer()
+
+        try:
+            table = self.service.tables().get(
+                projectId=self.project_id, datasetId=dataset_id, tableId=table_id,
+            ).execute()
+        except HttpError as ex:
+            self.process_http_error(ex)
+
+        # Project the schema to match the rows: tabledata.list returns selectedFields in table order
+        schema = table['schema']
+        if columns is not None:
+            field_by_i = dict(_project_fields(schema, columns))
+            schema = {'fields': [field_by_i[i] for i in sorted(field_by_i)]}
+        selected_fields = None if columns is None else ','.join(field['name'] for field in schema['fields'])
+
+        num_rows = int(table.get('numRows', 0))
+        start_index = min(start_index, num_rows)
+        end_index = num_rows if max_rows is None else min(num_rows, start_index + max_rows)
+        self.total_rows = end_index - start_index
+
+        def request_page(service, start_index, max_results):
+            return service.tabledata().list(
+                projectId=self.project_id,
+                datasetId=dataset_id,
+                tableId=table_id,
+                selectedFields=selected_fields,
+                startIndex=start_index,
+                maxResults=max_results,  # Limit: 10MB per page
+            )
+
+        self._print('Reading table[{}.{}] rows[{}:{}]...'.format(dataset_id, table_id, start_index, end_index))
+        self.stats = {}
+        page0 = []
+        if end_index > start_index:
+            try:
+                page0 = self._execute_json(request_page(
+                    self.service, start_index, min(max_results or end_index, end_index - start_index),
+                )).get('rows', [])
+            except HttpError as ex:
+                self.process_http_error(ex)
+        pages = self._fetch_pages(schema, page0, request_page, start_index, end_index, max_results, on_page, [])
         return schema, pages
 
+    def _execute_json(self, request):
+        """
+        Execute a googleapiclient request, but parse the raw response bytes with self.json_loads (e.g. orjson) instead
+        of the stdlib json that googleapiclient uses, since parsing big result pages takes a real share of cpu
+        """
+        def postproc(resp, content):
+            start_s = time.time()
+            x = self.json_loads(content)
+            with self._json_decode_lock:
+                self._json_decode_s += time.time() - start_s
+            return x
+        request.postproc = postproc  # Only called after execute has checked for http errors
+        return request.execute()
+
+    def record_ledger(self):
+        """
+        Record the last run_query in potoo.query_ledger, with job statistics from jobs.get (best effort), unless
+        ledger_source is None. Also update ledger_stats with them, if set.
+        """
+        if self.ledger_source is None and self.ledger_stats is None:
+            return
+        from potoo.query_ledger import ledger_record
+        stats = dict(self.stats)
+        try:
+            job_statistics = self.service.jobs().get(
+                projectId=stats['project_id'],
+                jobId=stats['job_id'],
+            ).execute()['statistics']
+            ms = lambda k: int(job_statistics[k]) if k in job_statistics else None
+            if ms('startTime') is not None:
+                stats['queue_s'] = (ms('startTime') - ms('creationTime')) / 1000
+                stats['run_s'] = (ms('endTime') - ms('startTime')) / 1000 if ms('endTime') else None
+            query_statistics = job_statistics.get('query', {})
+            stats['slot_ms'] = int(query_statistics.get('totalSlotMs', 0))
+            stats['bytes_billed'] = int(query_statistics.get('totalBytesBilled', 0))
+        except Exception as e:
+            self._print('Failed to get job statistics for ledger: {}'.format(e))
+        if self.ledger_stats is not None:
+            self.ledger_stats.update(stats)
+        if self.ledger_source is not None:
+            ledger_record(source=self.ledger_source, **stats)
+
+    def cancel(self, cancel_job=False):
+        """
+        Stop fetching result pages in run_query: pages not yet requested are skipped, and pages in flight are dropped
+
+        With cancel_job, also cancel the job that run_query is running (so it stops running and billing), but not an
+        existing job that it only reads from. Safe to call from another thread.
+        """
+        self._cancelled.set()
+        job_reference = self._inserted_job_reference
+        if cancel_job and job_reference is not None:
+            self._print('\nInterrupted: cancelling job[{}]...'.format(job_reference['jobId']))
+            self.cancel_job(job_reference)
+
     def load_data(self, dataframe, dataset_id, table_id, chunksize):
         try:
             from googleapiclient.errors import HttpError
@@ -610,7 +985,177 @@ class GbqConnector(object):
         sleep(delay)
 
 
-def _parse_data(schema, rows):
+def _resolve_json_loads(json_decoder=None):
+    """
+    json_decoder: a loads function, a module name ('orjson', 'ujson', 'json'), or None for the fastest one installed
+    """
+    if callable(json_decoder):
+        return json_decoder
+    for name in [json_decoder] if json_decoder else ['orjson', 'ujson', 'json']:
+        try:
+            return importlib.import_module(name).loads
+        except ImportError:
+            if json_decoder:
+                raise
+
+
+class _PageSink(object):
+    """
+    Feed pages to on_page in page order, as they arrive (out of order) from the parallel fetch workers, and release
+    each page from budget once on_page has consumed it
+
+    >>> pages, budget = [], _MemoryBudget(100)
+    >>> sink = _PageSink(pages.append, budget)
+    >>> for page_i in range(3):
+    ...     budget.acquire(page_i, 10)
+    >>> sink.put(2, 'c')
+    >>> sink.put(1, 'b')  # Held until page 0 arrives
+    >>> pages, budget.used_bytes
+    ([], 30)
+    >>> sink.put(0, 'a')
+    >>> pages, budget.used_bytes
+    (['a', 'b', 'c'], 0)
+    """
+
+    def __init__(self, on_page, budget=None):
+        self.on_page = on_page
+        self.budget = budget
+        self._lock = threading.Lock()
+        self.next_page_i = 0
+        self._pending = {}  # page_i -> rows, for pages that arrived before the pages ahead of them
+
+    def put(self, page_i, rows):
+        with self._lock:
+            self._pending[page_i] = rows
+            while self.next_page_i in self._pending:
+                self.on_page(self._pending.pop(self.next_page_i))
+                if self.budget:
+                    self.budget.release(self.next_page_i)
+                self.next_page_i += 1
+
+
+class _MemoryBudget(object):
+    """
+    Cap the (estimated) bytes of pages in flight + buffered: workers acquire bytes before fetching a page and pause
+    while the budget is full, and bytes are released as pages are consumed (e.g. decoded, or written to disk)
+
+    >>> budget = _MemoryBudget(100)
+    >>> budget.acquire(0, 60)
+    >>> worker = threading.Thread(target=budget.acquire, args=(1, 60))
+    >>> worker.start()
+    >>> worker.join(.1); worker.is_alive()  # Paused on the full budget
+    True
+    >>> budget.release(0)
+    >>> worker.join(1); worker.is_alive(), budget.used_bytes
+    (False, 60)
+    >>> budget.acquire(2, 60, can_skip_wait=lambda: True)  # e.g. the page the sink is waiting on: never paused
+    >>> budget.used_bytes
+    120
+    >>> budget.release(1); budget.release(2)
+    >>> budget.acquire(3, 1000)  # Over budget, but admitted when nothing else is using it (else it'd block forever)
+    >>> budget.used_bytes
+    1000
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._bytes_by_page_i = {}
+        self._cond = threading.Condition()
+
+    def acquire(self, page_i, n_bytes, can_skip_wait=lambda: False):
+        with self._cond:
+            # Always admit a page when nothing else is using the budget, else a too-small budget would block forever
+            while self.used_bytes > 0 and self.used_bytes + n_bytes > self.budget_bytes and not can_skip_wait():
+                self._cond.wait(timeout=.5)  # Timeout to re-check can_skip_wait, e.g. on cancel
+            self.used_bytes += n_bytes
+            self._bytes_by_page_i[page_i] = n_bytes
+
+    def release(self, page_i):
+        with self._cond:
+            self.used_bytes -= self._bytes_by_page_i.pop(page_i, 0)
+            self._cond.notify_all()
+
+
+def _estimate_bytes_per_row(rows, sample_size=100):
+    """
+    Estimate the in-memory (python objects) size of raw result rows, from a sample
+    """
+    sample = rows[:sample_size]
+    return 0 if not sample else sum(_deep_sizeof(row) for row in sample) / len(sample)
+
+
+def _deep_sizeof(x):
+    if isinstance(x, dict):
+        return sys.getsizeof(x) + sum(_deep_sizeof(v) for v in x.values())  # Keys are shared ('f', 'v')
+    elif isinstance(x, list):
+        return sys.getsizeof(x) + sum(_deep_sizeof(v) for v in x)
+    else:
+        return sys.getsizeof(x)
+
+
+def _resolve_columns(schema, columns=None, col_order=None):
+    """
+    Combine the columns projection and col_order into the list of columns for the decoder to produce, in order
+    """
+    if col_order is not None:
+        names = columns if columns is not None else [field['name'] for field in schema['fields']]
+        if sorted(col_order) != sorted(names):
+            raise InvalidColumnOrder(
+                'Column order does not match this DataFrame.'
+            )
+        columns = col_order
+    return columns
+
+
+def _project_fields(schema, columns=None):
+    """
+    Resolve the requested output columns to (i, field) pairs, where i indexes into each row's 'f' list, so the decoder
+    can jump straight to the cells it needs and never touch the rest
+    """
+    fields = schema['fields']
+    if columns is None:
+        return list(enumerate(fields))
+    i_by_name = {field['name']: i for i, field in enumerate(fields)}
+    missing = [name for name in columns if name not in i_by_name]
+    if missing:
+        raise InvalidColumnOrder(
+            'Columns {0} do not exist in query results.'.format(missing)
+        )
+    return [(i_by_name[name], fields[i_by_name[name]]) for name in columns]
+
+
+def _parse_data(schema, rows, columns=None, categorical_threshold=None):
+    decoder = _PageDecoder(schema, columns, categorical_threshold)
+    decoder.add_page(rows)
+    return decoder.to_dataframe()
+
+
+class _PageDecoder(object):
+    """
+    Decode result pages incrementally into column buffers, over only the projected fields (skipped cells in each row's
+    'f' list cost nothing)
+
+    STRING columns are dictionary-encoded as pages arrive: codes are built up across pages, and the column is emitted
+    as category dtype if it ends up with at most categorical_threshold distinct values (and values repeat, on average).
+    Columns that go over the threshold fall back to plain object values, with each str interned so that repeated
+    values share one object.
+
+    >>> schema = {'fields': [{'name': 's', 'type': 'STRING'}]}
+    >>> page = lambda *values: [{'f': [{'v': v}]} for v in values]
+    >>> decoder = _PageDecoder(schema, categorical_threshold=2)
+    >>> decoder.add_page(page('a', 'b', 'a', None))
+    >>> decoder.to_dataframe()['s'].dtype.name
+    'category'
+    >>> decoder.add_page(page('c'))  # Over the threshold
+    >>> decoder.to_dataframe()['s'].tolist()
+    ['a', 'b', 'a', None, 'c']
+    >>> decoder = _PageDecoder(schema, categorical_threshold=10)
+    >>> decoder.add_page(page('a', 'b', 'c'))  # Under the threshold, but mostly distinct
+    >>> decoder.to_dataframe()['s'].dtype.name
+    'object'
+    """
+
     # TODO(db) Is dtype_map important? Was previously used to build a numpy array that built the pandas df
     # # see: http://pandas.pydata.org/pandas-docs/dev/missing_data.html#missing-data-casting-rules-and-indexing
     # dtype_map = {'INTEGER': np.dtype(float),
@@ -618,13 +1163,82 @@ def _parse_data(schema, rows):
     #              # This seems to be buggy without nanosecond indicator
     #              'TIMESTAMP': 'M8[ns]'}
     # col_dtypes = [dtype_map.get(field['type'], object) for field in schema['fields']]
-    return DataFrame(
-        OrderedDict([
-            (field['name'], _parse_entry(field, row_cell))
-            for field, row_cell in zip(schema['fields'], row.get('f', []))
-        ])
-        for row in rows
-    )
+
+    def __init__(self, schema, columns=None, categorical_threshold=None):
+        self.fields = _project_fields(schema, columns)
+        self.categorical_threshold = categorical_threshold
+        self.n_rows = 0
+        # Per column: decoded values, or codes (-1 for null) while dictionary-encoding
+        self._values = []
+        # Per column: value -> code while dictionary-encoding, else None
+        self._codes_by_value = []
+        for i, field in self.fields:
+            is_string = field['type'] == 'STRING' and field.get('mode') != 'REPEATED'
+            if is_string and categorical_threshold:
+                self._values.append(array('i'))
+                self._codes_by_value.append(OrderedDict())
+            else:
+                self._values.append([])
+                self._codes_by_value.append(None)
+
+    @property
+    def columns(self):
+        return [field['name'] for i, field in self.fields]
+
+    def add_page(self, rows):
+        for j, (i, field) in enumerate(self.fields):
+            values = self._values[j]
+            codes_by_value = self._codes_by_value[j]
+            if codes_by_value is not None:
+                self._add_codes(values, codes_by_value, field, i, rows)
+                if len(codes_by_value) > self.categorical_threshold:
+                    # Too many distinct values to be worth a category: fall back to (already shared) plain values
+                    categories = list(codes_by_value)
+                    self._values[j] = [None if code < 0 else categories[code] for code in values]
+                    self._codes_by_value[j] = None
+            elif field['type'] == 'STRING' and field.get('mode') != 'REPEATED':
+                values.extend([self._intern(_parse_entry(field, row['f'][i])) for row in rows])
+            else:
+                values.extend([_parse_entry(field, row['f'][i]) for row in rows])
+        self.n_rows += len(rows)
+
+    def _add_codes(self, codes, codes_by_value, field, i, rows):
+        for row in rows:
+            value = _parse_entry(field, row['f'][i])
+            if value is None:
+                codes.append(-1)
+            else:
+                code = codes_by_value.get(value)
+                if code is None:
+                    code = codes_by_value[sys.intern(value)] = len(codes_by_value)
+                codes.append(code)
+
+    @staticmethod
+    def _intern(value):
+        return None if value is None else sys.intern(value)
+
+    def to_dataframe(self, copy=False):
+        """
+        copy: copy the column buffers, to snapshot a decoder that will keep getting pages (codes arrays can't grow
+        while numpy shares their memory)
+        """
+        return DataFrame(OrderedDict([
+            (field['name'], self._column(j, copy))
+            for j, (i, field) in enumerate(self.fields)
+        ]))
+
+    def _column(self, j, copy=False):
+        values = self._values[j]
+        codes_by_value = self._codes_by_value[j]
+        if codes_by_value is None:
+            return list(values) if copy else values
+        categories = list(codes_by_value)
+        if 0 < 2 * len(categories) <= self.n_rows:
+            codes = np.frombuffer(values, dtype=values.typecode)
+            return Categorical.from_codes(codes.copy() if copy else codes, categories)
+        else:
+            # Mostly-distinct values: a category would cost more than it saves
+            return [None if code < 0 else categories[code] for code in values]
 
 
 def _parse_entry(field, row_cell):
@@ -655,9 +1269,23 @@ def _parse_entry(field, row_cell):
 
 
 def read_gbq(query, project_id=None, index_col=None, col_order=None,
-             reauth=False, verbose=True, private_key=None, dialect='legacy',
+             columns=None, reauth=False, verbose=True, private_key=None, dialect='legacy',
              max_results=None,  # TODO limit is 10MB per page, not in terms of row count
              use_query_cache=True,
+             categorical_threshold=1000,
+             to_path=None,
+             progressive=False,
+             coalesce=True,
+             job_id=None,
+             split_by=None,
+             memory_budget=None,
+             json_decoder=None,
+             start_index=0,
+             max_rows=None,
+             ledger_source='read_gbq',
+             rerun_unreadable_job=True,
+             credentials=None,
+             ledger_stats=None,
              ):
     """Load data from Google BigQuery.
 
@@ -696,7 +1324,12 @@ def read_gbq(query, project_id=None, index_col=None, col_order=None,
         Name of result column to use for index in results DataFrame
     col_order : list(str) (optional)
         List of BigQuery column names in the desired order for results
-        DataFrame
+        DataFrame. Applied inside the decoder, like columns.
+    columns : list(str) (optional)
+        Subset of BigQuery column names to decode, in the desired order for
+        results DataFrame. Cells of all other columns are skipped while
+        decoding, so exploring a wide `select *` only pays for the columns
+        you look at.
     reauth : boolean (default False)
         Force Google BigQuery to reauthenticate the user. This is useful
         if multiple accounts are used.
@@ -718,32 +1351,383 @@ def read_gbq(query, project_id=None, index_col=None, col_order=None,
 
         .. versionadded:: 0.19.0
 
+    start_index : int (default 0)
+        Index of the first result row to read
+    max_rows : int (optional)
+        Read at most this many result rows, starting at start_index. Pages
+        past the last row are never fetched. Default: all rows.
+    ledger_source : str (default 'read_gbq')
+        Source to record the query under in potoo.query_ledger, or None to
+        not record it (e.g. if the caller records it itself).
+    ledger_stats : dict (optional)
+        Update this dict with the stats recorded for the query in
+        potoo.query_ledger (job and fetch timings, slot_ms, bytes_billed,
+        ...), e.g. for a caller that records the query itself. Not filled
+        by reads that coalesce onto another caller's read.
+    rerun_unreadable_job : boolean (default True)
+        With job_id, re-run the job's query if its results aren't readable
+        (expired, or readable only with other credentials). If False, raise
+        instead, e.g. when the caller just ran the job and re-running it
+        would bill it twice.
+    credentials : oauth2client credentials (optional)
+        Use these instead of looking up credentials (application default,
+        else user account), e.g. the credentials that ran job_id. Skips the
+        lookup's probe job.
+    categorical_threshold : int (default 1000)
+        STRING columns with at most this many distinct values (that repeat,
+        on average) are returned as category dtype, with codes built up
+        while decoding. All other STRING values are interned, so repeated
+        values share one object. Falsy to disable categories (interning
+        still applies).
+    to_path : str (optional)
+        Stream decoded pages into a columnar (parquet) file at this path, or
+        into one part file per page if it ends in '/', without ever holding
+        the full DataFrame in memory. Requires pyarrow.
+    progressive : boolean (default False)
+        Return as soon as the first page is decoded, with a
+        ProgressiveResult that keeps fetching the remaining pages in the
+        background (see ProgressiveResult).
+    coalesce : boolean (default True)
+        If an identical read (same normalized query, project, dialect and
+        decode args) is already in flight, e.g. from another thread, wait
+        for it and share its job and decoded results instead of running
+        the query again. Only reads with the default credentials coalesce,
+        so never with private_key, reauth or credentials.
+    job_id : str (optional)
+        Read the results of this existing job instead of running query
+        (pass query=None), going straight to the parallel page fetcher.
+        Falls back to re-running the job's query only if its results aren't
+        readable (see rerun_unreadable_job).
+    split_by : (str, int or list) (optional)
+        (column, n_parts) or (column, [(lo, hi), ...]). Rewrite query into
+        disjoint range-filtered sub-queries on column (lo <= column < hi,
+        None for unbounded), run them concurrently and merge the results in
+        order. With n_parts, ranges are computed from the column's min/max
+        (INTEGER, FLOAT, DATE or TIMESTAMP), and nulls go in the first part.
+        Useful for huge scans over e.g. date-partitioned tables.
+    memory_budget : int (optional)
+        Cap on the estimated bytes of result pages in flight or waiting to
+        be decoded (or written to to_path). Fetch workers pause while the
+        budget is full, and the progress output reports peak RSS against
+        the budget. Doesn't apply to split_by.
+    json_decoder : callable or str (optional)
+        How to parse raw result pages: a loads function, or a module name
+        ('orjson', 'ujson', 'json'). Default: the fastest one installed,
+        falling back to the stdlib json.
+
     Returns
     -------
     df: DataFrame
-        DataFrame representing results of query
+        DataFrame representing results of query, or a lazy
+        potoo.columnar.ColumnarFrame over to_path if given, or a
+        ProgressiveResult if progressive
 
     """
 
     if not project_id:
         raise TypeError("Missing required parameter: project_id")
 
+    if query is None and job_id is None:
+        raise TypeError("Missing required parameter: query (or job_id)")
+
     if dialect not in ('legacy', 'standard'):
         raise ValueError("'{0}' is not valid for dialect".format(dialect))
 
+    def make_connector():
+        connector = GbqConnector(project_id, reauth=reauth, verbose=verbose,
+                                 private_key=private_key,
+                                 dialect=dialect, use_query_cache=use_query_cache,
+                                 memory_budget=memory_budget, json_decoder=json_decoder,
+                                 credentials=credentials)
+        connector.ledger_source = ledger_source
+        connector.rerun_unreadable_job = rerun_unreadable_job
+        connector.ledger_stats = ledger_stats
+        return connector
+
+    if split_by is not None and (to_path is not None or progressive or job_id is not None or start_index or
+                                 max_rows is not None):
+        raise ValueError('split_by is not supported with to_path, progressive, job_id, start_index or max_rows')
+
+    if to_path is not None:
+        if index_col is not None:
+            raise ValueError('index_col is not supported with to_path')
+        return _read_gbq_to_path(make_connector(), query, max_results, to_path, columns, col_order, job_id,
+                                 start_index, max_rows)
+
+    if progressive:
+        return ProgressiveResult(make_connector(), query, max_results, columns, col_order, index_col,
+                                 categorical_threshold, job_id, start_index, max_rows)
+
+    def read_df():
+        if split_by is not None:
+            return _read_gbq_split(make_connector, query, max_results, split_by, columns, col_order, index_col,
+                                   categorical_threshold)
+        else:
+            return _read_gbq_df(make_connector(), query, max_results, columns, col_order, index_col,
+                                categorical_threshold, job_id, start_index, max_rows)
+
+    # Only coalesce reads with the process's default credentials, else a caller could get results read with another
+    # caller's credentials
+    if not coalesce or private_key is not None or reauth or credentials is not None:
+        return read_df()
+
+    # Concurrent identical reads share one job and one decode, and each caller gets its own (shallow) copy
+    key = (
+        _normalize_sql(query or ''), job_id, project_id, dialect, use_query_cache, max_results, start_index, max_rows,
+        tuple(columns or ()), tuple(col_order or ()), index_col, categorical_threshold, repr(split_by),
+    )
+    final_df, is_leader = _read_gbq_flights.do(key, read_df)
+    if not is_leader:
+        if verbose:
+            print('Shared results with an identical in-flight query')
+        final_df = final_df.copy(deep=False)
+    return final_df
+
+
+def read_gbq_table(dataset_id, table_id, project_id=None, columns=None, start_index=0, max_rows=None,
+                   index_col=None, reauth=False, verbose=True, private_key=None, max_results=None,
+                   categorical_threshold=1000, memory_budget=None, json_decoder=None):
+    """Load rows of a BigQuery table without running a query.
+
+    Reads straight from table storage via tabledata.list, fetching pages in
+    parallel and decoding them like read_gbq. Unlike `select * ... limit n`,
+    this bills no bytes and doesn't wait on a query job, so it's the cheap
+    way to preview (or page through) a table.
+
+    Parameters
+    ----------
+    dataset_id : str
+        Dataset of the table
+    table_id : str
+        Table to read
+    project_id : str
+        Google BigQuery Account project ID (of the table).
+    columns : list(str) (optional)
+        Subset of (top-level) column names to read, in the desired order for
+        results DataFrame. Only these columns are transferred.
+    start_index : int (default 0)
+        Index of the first row to read
+    max_rows : int (optional)
+        Read at most this many rows, starting at start_index. Default: all
+        remaining rows.
+    index_col, reauth, verbose, private_key, max_results,
+    categorical_threshold, memory_budget, json_decoder
+        As in read_gbq
+
+    Returns
+    -------
+    df: DataFrame
+        DataFrame of rows [start_index, start_index + max_rows), in table
+        order
+
+    """
+
+    if not project_id:
+        raise TypeError("Missing required parameter: project_id")
+
     connector = GbqConnector(project_id, reauth=reauth, verbose=verbose,
                              private_key=private_key,
-                             dialect=dialect, use_query_cache=use_query_cache)
-    schema, pages = connector.run_query(query, max_results)
-    dataframe_list = []
-    while len(pages) > 0:
-        page = pages.pop()
-        dataframe_list.append(_parse_data(schema, page))
-
-    if len(dataframe_list) > 0:
-        final_df = concat(dataframe_list, ignore_index=True)
+                             memory_budget=memory_budget, json_decoder=json_decoder)
+    decoder_ref = {'decoder': None}  # Mutable ref cell to share across functions calls
+
+    def decode_page(schema, rows):
+        if decoder_ref['decoder'] is None:
+            decoder_ref['decoder'] = _PageDecoder(schema, columns, categorical_threshold)
+        decoder_ref['decoder'].add_page(rows)
+
+    try:
+        # (Always calls on_page at least once, even with no rows, so decoder_ref is always set)
+        connector.read_table(dataset_id, table_id, columns, start_index, max_rows, max_results, on_page=decode_page)
+    except KeyboardInterrupt:
+        pass
+    else:
+        return _finish_dataframe(connector, decoder_ref['decoder'], index_col)
+
+    # Stop the page workers and re-raise outside of the except block (like run_query)
+    connector.cancel()
+    raise KeyboardInterrupt
+
+
+def _read_gbq_df(connector, query, max_results, columns=None, col_order=None, index_col=None,
+                 categorical_threshold=None, job_id=None, start_index=0, max_rows=None):
+
+    # Decode pages as they arrive (in order), so each page's raw rows are freed as soon as they're decoded
+    decoder_ref = {'decoder': None}  # Mutable ref cell to share across functions calls
+
+    def decode_page(schema, rows):
+        if decoder_ref['decoder'] is None:
+            # Project and order columns inside the decoder (instead of reordering after), so unneeded cells are never
+            # parsed
+            decoder_ref['decoder'] = _PageDecoder(
+                schema, _resolve_columns(schema, columns, col_order), categorical_threshold,
+            )
+        decoder_ref['decoder'].add_page(rows)
+
+    connector.run_query(query, max_results, on_page=decode_page, job_id=job_id, start_index=start_index,
+                        max_rows=max_rows)
+
+    return _finish_dataframe(connector, decoder_ref['decoder'], index_col)
+
+
+def _read_gbq_split(make_connector, query, max_results, split_by, columns=None, col_order=None, index_col=None,
+                    categorical_threshold=None):
+    """
+    Rewrite query into disjoint range-filtered sub-queries, run them concurrently (each one fetching its pages in
+    parallel), and decode their results in order
+    """
+    import dask
+
+    connector = make_connector()
+    connector._start_timer()
+    column, parts = split_by
+    if isinstance(parts, int):
+        conds = _split_conds(connector, query, column, parts)
+    else:
+        conds = [_range_cond(column, _sql_literal(lo), _sql_literal(hi)) for lo, hi in parts]
+    sub_queries = ['select * from ({0}) where {1}'.format(query, cond) for cond in conds]
+    connector._print('Running {0} sub-queries split by {1}...'.format(len(sub_queries), column))
+
+    # One connector per sub-query, since connectors aren't thread safe. Create them in the dask threads (each one
+    # looks up credentials and builds a service, so creating them serially would delay every sub-query), but register
+    # them as they're created, so that on Ctrl-C -- which only interrupts this thread -- or a failed sub-query we can
+    # cancel all of them.
+    sub_connectors = []
+    sub_connectors_lock = threading.Lock()
+    interrupted = threading.Event()
+
+    def run_sub_query(sub_query):
+        sub_connector = make_connector()
+        with sub_connectors_lock:
+            sub_connectors.append(sub_connector)
+        if interrupted.is_set():  # Don't start sub-queries after an interrupt
+            return None
+        return sub_connector.run_query(sub_query, max_results)
+
+    try:
+        results = dask.delayed(list)([
+            dask.delayed(run_sub_query)(sub_query)
+            for sub_query in sub_queries
+        ]).compute(
+            get=dask.threaded.get,
+            num_workers=len(sub_queries),
+        )
+    except BaseException as e:
+        error = e
+    else:
+        return _decode_split_results(connector, results, columns, col_order, index_col, categorical_threshold)
+
+    # Stop every sub-query's page fetch and job (outside the except block, like run_query)
+    interrupted.set()
+    with sub_connectors_lock:
+        cancel_connectors = list(sub_connectors)
+    for sub_connector in cancel_connectors:
+        sub_connector.cancel(cancel_job=True)
+    raise error
+
+
+def _decode_split_results(connector, results, columns, col_order, index_col, categorical_threshold):
+
+    # Decode all parts with one decoder, so categories are consistent across parts
+    [(schema, _), *_] = results
+    decoder = _PageDecoder(schema, _resolve_columns(schema, columns, col_order), categorical_threshold)
+    for _, pages in results:
+        pages.reverse()
+        while len(pages) > 0:
+            decoder.add_page(pages.pop())
+
+    return _finish_dataframe(connector, decoder, index_col)
+
+
+def _split_conds(connector, query, column, n_parts):
+    """
+    Split column's [min, max] into n_parts ranges, as where conditions that cover all rows (incl. nulls)
+    """
+    schema, pages = connector.run_query(
+        'select min({0}) as lo, max({0}) as hi from ({1})'.format(column, query),
+        None,
+    )
+    [[lo, hi]] = [[cell['v'] for cell in row['f']] for page in pages for row in page]
+    type_ = schema['fields'][0]['type']
+    if lo is None:
+        return ['true']  # All null: nothing to split
+
+    # Split on a numeric representation, and format the cut points back as sql
+    if type_ == 'INTEGER':
+        (lo, hi), integral, to_sql = map(int, (lo, hi)), True, str
+    elif type_ == 'FLOAT':
+        (lo, hi), integral, to_sql = map(float, (lo, hi)), False, repr
+    elif type_ == 'DATE':
+        (lo, hi) = (datetime.strptime(x, '%Y-%m-%d').toordinal() for x in (lo, hi))
+        integral, to_sql = True, lambda x: "'{0}'".format(date.fromordinal(x).isoformat())
+    elif type_ == 'TIMESTAMP':
+        (lo, hi) = (int(round(float(x) * 1e6)) for x in (lo, hi))  # Micros
+        integral = True
+        to_sql = ('USEC_TO_TIMESTAMP({0})' if connector.dialect == 'legacy' else 'TIMESTAMP_MICROS({0})').format
     else:
-        final_df = _parse_data(schema, [])
+        raise ValueError(
+            'Can only split_by INTEGER, FLOAT, DATE or TIMESTAMP columns into n_parts, not {0} (pass explicit '
+            'ranges instead)'.format(type_)
+        )
+
+    span = hi - lo + 1 if integral else hi - lo
+    cuts = sorted(set(
+        lo + (span * k // n_parts if integral else span * k / n_parts)
+        for k in range(1, n_parts)
+    ) - {lo})
+    bounds = [None] + cuts + [None]
+    return [
+        _range_cond(column, to_sql(a) if a is not None else None, to_sql(b) if b is not None else None, nulls=i == 0)
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def _range_cond(column, lo, hi, nulls=False):
+    """
+    Where condition for lo <= column < hi, given sql literals (None for unbounded)
+
+    >>> _range_cond('x', 1, 10)
+    'x >= 1 and x < 10'
+    >>> _range_cond('x', None, 10, nulls=True)
+    '(x < 10) or x is null'
+    >>> _range_cond('x', None, None)
+    'true'
+    """
+    terms = []
+    if lo is not None:
+        terms.append('{0} >= {1}'.format(column, lo))
+    if hi is not None:
+        terms.append('{0} < {1}'.format(column, hi))
+    cond = ' and '.join(terms) or 'true'
+    if nulls:
+        cond = '({0}) or {1} is null'.format(cond, column)
+    return cond
+
+
+def _sql_literal(value):
+    if value is None:
+        return None
+    elif isinstance(value, str):
+        return "'{0}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
+    elif isinstance(value, (date, datetime)):
+        return "'{0}'".format(value.isoformat())
+    else:
+        return str(value)
+
+
+def _finish_dataframe(connector, decoder, index_col=None):
+
+    final_df = _shape_dataframe(decoder.to_dataframe(), index_col)
+
+    connector.print_elapsed_seconds(
+        'Total time taken',
+        datetime.now().strftime('s.\nFinished at %Y-%m-%d %H:%M:%S.'),
+        0
+    )
+
+    return final_df
+
+
+def _shape_dataframe(final_df, index_col=None):
 
     # Reindex the DataFrame on the provided column
     if index_col is not None:
@@ -755,27 +1739,253 @@ def read_gbq(query, project_id=None, index_col=None, col_order=None,
                 .format(index_col)
             )
 
-    # Change the order of columns in the DataFrame based on provided list
-    if col_order is not None:
-        if sorted(col_order) == sorted(final_df.columns):
-            final_df = final_df[col_order]
-        else:
-            raise InvalidColumnOrder(
-                'Column order does not match this DataFrame.'
-            )
-
     # Downcast floats to integers and objects to booleans
     # if there are no NaN's. This is presently due to a
     # limitation of numpy in handling missing data.
     final_df._data = final_df._data.downcast(dtypes='infer')
 
+    return final_df
+
+
+def _normalize_sql(query):
+    """
+    Collapse whitespace outside of quoted strings and identifiers (where whitespace is significant)
+
+    >>> _normalize_sql("  select  'a  b' as x,   `my  col`  from t ")
+    "select 'a  b' as x, `my  col` from t"
+    """
+    return re.sub(
+        r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+""",
+        lambda m: m.group(1) or ' ',
+        query,
+    ).strip()
+
+
+class _SingleFlight(object):
+    """
+    Coalesce concurrent calls with the same key: the first caller (the leader) runs f, and callers that arrive while
+    it's in flight wait for it and share its result (or Exception). Nothing is kept once the call completes.
+
+    If the leader dies on a BaseException that isn't an Exception (e.g. KeyboardInterrupt, which only interrupted the
+    leader's thread), followers don't share it: one of them takes over as leader and runs f itself.
+
+    >>> flights = _SingleFlight()
+    >>> flights.do('k', lambda: 'a')
+    ('a', True)
+    >>> def lead(f):
+    ...     # Returns what (leader, follower) each got, where the follower joins while the leader is running f
+    ...     started, release, results = threading.Event(), threading.Event(), {}
+    ...     def run(role, f):
+    ...         try:
+    ...             results[role] = flights.do('k', f)
+    ...         except BaseException as e:
+    ...             results[role] = type(e).__name__
+    ...     def leader_f():
+    ...         started.set(); release.wait()
+    ...         return f()
+    ...     leader = threading.Thread(target=run, args=('leader', leader_f)); leader.start(); started.wait()
+    ...     follower = threading.Thread(target=run, args=('follower', lambda: 'z')); follower.start()
+    ...     time.sleep(.1)  # Let the follower join the flight
+    ...     release.set(); leader.join(); follower.join()
+    ...     return results['leader'], results['follower']
+    >>> def raise_(e):
+    ...     raise e
+    >>> lead(lambda: 'b')  # The follower shares the leader's result
+    (('b', True), ('b', False))
+    >>> lead(lambda: raise_(ValueError()))  # ...and its Exception
+    ('ValueError', 'ValueError')
+    >>> lead(lambda: raise_(KeyboardInterrupt()))  # But takes over from an interrupted leader
+    ('KeyboardInterrupt', ('z', True))
+    """
+
+    class _Flight(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.abandoned = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+
+    def do(self, key, f):
+        """
+        Returns (result, is_leader)
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                is_leader = flight is None
+                if is_leader:
+                    flight = self._flights[key] = self._Flight()
+            if is_leader:
+                try:
+                    flight.result = f()
+                except Exception as e:
+                    flight.error = e
+                    raise
+                except BaseException:
+                    flight.abandoned = True
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+                return flight.result, is_leader
+            flight.done.wait()
+            if flight.abandoned:
+                continue  # Take over as leader (or follow whichever follower got there first)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, is_leader
+
+
+_read_gbq_flights = _SingleFlight()
+
+
+class ProgressiveResult(object):
+    """
+    Handle to a read_gbq that returns as soon as the first page is decoded, and keeps fetching and decoding the rest
+    of the pages on a background thread
+
+    Example usage:
+        r = pd_read_bq('select ...', progressive=True)
+        r            # Displays the first page (+ progress) while still loading
+        r.progress   # Fraction of rows decoded so far
+        r.cancel()   # Stop fetching; r.result() then returns the rows decoded so far
+        df = r.result()
+    """
+
+    def __init__(self, connector, query, max_results, columns=None, col_order=None, index_col=None,
+                 categorical_threshold=None, job_id=None, start_index=0, max_rows=None):
+        self._connector = connector
+        self._columns = columns
+        self._col_order = col_order
+        self._index_col = index_col
+        self._categorical_threshold = categorical_threshold
+        self._decoder = None
+        self._head_df = None
+        self._df = None
+        self._error = None
+        self._first_page = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(query, max_results, job_id, start_index, max_rows),
+                                        daemon=True)
+        self._thread.start()
+        try:
+            self._first_page.wait()
+        except KeyboardInterrupt:
+            pass
+        else:
+            if self._error is not None:
+                raise self._error
+            return
+
+        # Ctrl-C only interrupts this (main) thread, so stop the background run_query and its job ourselves
+        self._connector.cancel(cancel_job=True)
+        raise KeyboardInterrupt
+
+    def _run(self, query, max_results, job_id, start_index, max_rows):
+        try:
+            self._connector.run_query(query, max_results, on_page=self._on_page, job_id=job_id,
+                                      start_index=start_index, max_rows=max_rows)
+            self._df = _finish_dataframe(self._connector, self._decoder, self._index_col)
+        except BaseException as e:  # Incl. the KeyboardInterrupt that run_query raises when cancelled
+            self._error = e
+        finally:
+            self._first_page.set()
+            self._done.set()
+
+    def _on_page(self, schema, rows):
+        if self._decoder is None:
+            columns = _resolve_columns(schema, self._columns, self._col_order)
+            self._decoder = _PageDecoder(schema, columns, self._categorical_threshold)
+            self._decoder.add_page(rows)
+            self._head_df = _shape_dataframe(self._decoder.to_dataframe(copy=True), self._index_col)
+            self._first_page.set()
+        else:
+            self._decoder.add_page(rows)
+
+    def head(self, n=None):
+        return self._head_df if n is None else self._head_df.head(n)
+
+    @property
+    def progress(self):
+        total_rows = self._connector.total_rows
+        return 1.0 if not total_rows else self._decoder.n_rows / total_rows
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        self._connector.cancel()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Still fetching: {0:.0%} of rows decoded'.format(self.progress))
+        if self._error is not None:
+            raise self._error
+        return self._df
+
+    def _status(self):
+        if self._error is not None:
+            return 'Failed: {0!r}'.format(self._error)
+        elif self.done():
+            return 'Done: {0} rows'.format(self._decoder.n_rows)
+        else:
+            return 'Loading: {0}/{1} rows ({2:.0%}), showing first page'.format(
+                self._decoder.n_rows, self._connector.total_rows, self.progress,
+            )
+
+    def __repr__(self):
+        return '{0}\n{1!r}'.format(self._status(), self._head_df)
+
+    def _repr_html_(self):
+        return '<div>{0}</div>{1}'.format(self._status(), self._head_df._repr_html_())
+
+
+def _read_gbq_to_path(connector, query, max_results, to_path, columns=None, col_order=None, job_id=None,
+                      start_index=0, max_rows=None):
+    from potoo.columnar import ColumnarWriter
+
+    # Create the writer on the first page, once we know the schema
+    writer_ref = {'writer': None}  # Mutable ref cell to share across functions calls
+
+    def write_page(schema, rows):
+        page_columns = _resolve_columns(schema, columns, col_order)
+        if writer_ref['writer'] is None:
+            writer_ref['writer'] = ColumnarWriter(to_path, types={
+                field['name']: _arrow_type_aliases[field['type']]
+                for i, field in _project_fields(schema, page_columns)
+                if field.get('mode') != 'REPEATED' and field['type'] in _arrow_type_aliases
+            })
+        # No categoricals: the file format already dictionary-encodes repetitive columns
+        decoder = _PageDecoder(schema, page_columns)
+        decoder.add_page(rows)
+        writer_ref['writer'].write(decoder.to_dataframe())
+
+    connector.run_query(query, max_results, on_page=write_page, job_id=job_id, start_index=start_index,
+                        max_rows=max_rows)
+    columnar_frame = writer_ref['writer'].close()
+
     connector.print_elapsed_seconds(
         'Total time taken',
         datetime.now().strftime('s.\nFinished at %Y-%m-%d %H:%M:%S.'),
         0
     )
 
-    return final_df
+    return columnar_frame
+
+
+# BigQuery type -> pyarrow type alias, for ColumnarWriter (nested types are left to pyarrow to infer)
+_arrow_type_aliases = {
+    'STRING': 'string',
+    'INTEGER': 'int64',
+    'FLOAT': 'float64',
+    'BOOLEAN': 'bool',
+    'TIMESTAMP': 'timestamp[us]',
+}
 
 
 def to_gbq(dataframe, destination_table, project_id, chunksize=10000,
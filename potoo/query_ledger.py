@@ -0,0 +1,107 @@
+"""
+Local sqlite ledger of bigquery calls (read_gbq, %bq, bqq), to spot regressions and expensive cells
+
+Example usage:
+    query_ledger()                                   # All recorded queries, newest first
+    query_ledger(n=20).sort_values('bytes_billed')   # Most expensive of the last 20
+"""
+
+from collections import OrderedDict
+from contextlib import closing
+from datetime import datetime
+import hashlib
+import os
+import sqlite3
+
+import pandas as pd
+
+
+# Mutate (or set $POTOO_QUERY_LEDGER) to use a different ledger; ''/None disables recording
+ledger_path = os.environ.get('POTOO_QUERY_LEDGER', os.path.expanduser('~/.potoo/query_ledger.sqlite'))
+
+# Column name -> sqlite type
+ledger_columns = OrderedDict([
+    ('recorded_at',     'text'),     # Local time, isoformat
+    ('source',          'text'),     # e.g. 'read_gbq', '%bq', 'bqq'
+    ('sql_hash',        'text'),
+    ('sql',             'text'),
+    ('project_id',      'text'),
+    ('job_id',          'text'),
+    ('bytes_processed', 'integer'),
+    ('bytes_billed',    'integer'),
+    ('cache_hit',       'integer'),  # 0/1
+    ('slot_ms',         'integer'),
+    ('queue_s',         'real'),     # Job created -> started
+    ('run_s',           'real'),     # Job started -> ended
+    ('query_s',         'real'),     # Wall time until the job completed, as seen by the client
+    ('fetch_s',         'real'),     # Wall time to fetch all result pages
+    ('decode_s',        'real'),     # Time spent decoding pages (overlaps with fetch_s when pages are streamed)
+    ('json_decode_s',   'real'),     # Time spent parsing raw page json, summed over fetch threads
+    ('rows',            'integer'),
+    ('pages',           'integer'),
+    ('peak_rss_bytes',  'integer'),
+])
+
+
+def sql_hash(sql: str) -> str:
+    return None if sql is None else hashlib.sha1(sql.encode('utf8')).hexdigest()[:16]
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(ledger_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(ledger_path, timeout=10)
+    try:
+        conn.execute('create table if not exists queries (%s)' % ', '.join(
+            '%s %s' % (name, type_) for name, type_ in ledger_columns.items()
+        ))
+        # Add columns that are newer than the ledger file
+        existing = {row[1] for row in conn.execute('pragma table_info(queries)')}
+        for name, type_ in ledger_columns.items():
+            if name not in existing:
+                conn.execute('alter table queries add column %s %s' % (name, type_))
+        conn.commit()
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def ledger_record(**row):
+    """
+    Record one query in the ledger. Missing columns are recorded as null, and failures only warn, since the ledger
+    should never break the query it's recording.
+    """
+    if not ledger_path:
+        return
+    row.setdefault('recorded_at', datetime.now().isoformat())
+    row.setdefault('sql_hash', sql_hash(row.get('sql')))
+    try:
+        unknown = set(row) - set(ledger_columns)
+        if unknown:
+            raise ValueError(f'Unknown ledger columns: {unknown}')
+        with closing(_connect()) as conn, conn:  # Close, and commit (conn's own context manager doesn't close)
+            conn.execute(
+                'insert into queries (%s) values (%s)' % (
+                    ', '.join(ledger_columns),
+                    ', '.join('?' * len(ledger_columns)),
+                ),
+                [row.get(name) for name in ledger_columns],
+            )
+    except Exception as e:
+        print(f'Failed to record query in ledger[{ledger_path}]: {e}')
+
+
+def query_ledger(n: int = None, source: str = None) -> pd.DataFrame:
+    """
+    Recorded queries as a df, newest first
+    """
+    with closing(_connect()) as conn:
+        return pd.read_sql(
+            'select * from queries %s order by recorded_at desc %s' % (
+                'where source = ?' if source else '',
+                'limit %d' % n if n else '',
+            ),
+            conn,
+            params=[source] if source else [],
+            parse_dates=['recorded_at'],
+        )
@@ -0,0 +1,163 @@
+"""
+Opt-in on-disk cache of sql query results (pd_read_sql, %sqla), as columnar files keyed on sql + params + db url, with
+ttl and lru eviction
+
+Example usage:
+    df = pd_read_sql(db, 'select ...', cache=True)                        # Re-run only when the cache entry expires
+    df = pd_read_sql(db, 'select ...', cache=True, refresh=True)          # Re-run and re-cache
+    df = pd_read_sql(db, 'select ...', cache=True, cache_marker=lambda: sql_cache_table_marker(db.bind, ['t']))
+    sql_cache_clear()
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from potoo.columnar import ColumnarFrame, ColumnarWriter
+
+
+# Mutate (or set $POTOO_SQL_CACHE) to use a different cache dir
+cache_dir = os.environ.get('POTOO_SQL_CACHE', os.path.expanduser('~/.potoo/sql_cache'))
+cache_max_bytes = 10 * 1024**3  # Evict least recently used entries beyond this
+cache_ttl_s = 24 * 3600  # Default ttl; None means entries never expire
+
+_cache_lock = threading.Lock()
+
+
+def sql_cache_key(db_url, sql, params=None) -> str:
+    """
+    Key on the db url (with password, so different users don't share entries), sql text, and bound params, where sql
+    can be a str or a sqla clause (e.g. sqla.text(...).bindparams(...))
+    - The sql text is keyed as is (only stripped), not whitespace-normalized, since whitespace inside string literals
+      changes the result
+    """
+    if hasattr(sql, 'compile'):
+        compiled = sql.compile()
+        sql, params = str(compiled), {**compiled.params, **(params or {})}
+    return hashlib.sha1(json.dumps(
+        [str(db_url), str(sql).strip(), params],
+        sort_keys=True,
+        default=str,
+    ).encode('utf8')).hexdigest()
+
+
+def sql_cache_read(db_url, sql, read, params=None, ttl_s='default', marker=None, refresh=False,
+                   quiet=False) -> pd.DataFrame:
+    """
+    Return the cached result of sql if there's a fresh entry for it, else read() and cache its result
+    - ttl_s: ignore entries older than this ('default' means cache_ttl_s, None means never expire)
+    - marker: optional invalidation hook, e.g. sql_cache_table_marker; entries are only used if marker() still returns
+      what it returned when the entry was cached (e.g. the tables it reads haven't changed)
+    - refresh: ignore any cached entry, and re-cache
+    """
+    ttl_s = cache_ttl_s if ttl_s == 'default' else ttl_s
+    key = sql_cache_key(db_url, sql, params)
+    data_path, meta_path = _paths(key)
+    marker_value = None if marker is None else repr(marker())
+
+    if not refresh:
+        meta = _read_meta(meta_path)
+        if (
+            meta is not None and
+            (ttl_s is None or time.time() - meta['created_s'] <= ttl_s) and
+            meta['marker'] == marker_value
+        ):
+            try:
+                df = ColumnarFrame(data_path).to_pandas()
+            except Exception as e:
+                if not quiet:
+                    print(f'Failed to read cache entry[{key}], re-running: {e}')
+            else:
+                os.utime(meta_path)  # Touch, for lru
+                if not quiet:
+                    print('Cached result from %s (refresh to re-run)' % (
+                        datetime.fromtimestamp(meta['created_s']).strftime('%Y-%m-%d %H:%M:%S'),
+                    ))
+                return df
+
+    df = read()
+    _write(key, df, {
+        'created_s': time.time(),
+        'db_url': repr(db_url),  # repr masks the password, str doesn't
+        'sql': str(sql),
+        'marker': marker_value,
+    })
+    return df
+
+
+def sql_cache_table_marker(con, tables) -> list:
+    """
+    Cheap "have these postgres tables changed" marker, from the tables' cumulative insert/update/delete counters (which
+    lag writes by up to the stats collector's ~0.5s)
+    - con: sqla engine or connection
+    """
+    with con.connect() as conn:
+        return [
+            tuple(row)
+            for table in tables
+            for row in conn.execute(
+                'select n_tup_ins, n_tup_upd, n_tup_del from pg_stat_all_tables where relid = %s::regclass',
+                (table,),
+            )
+        ]
+
+
+def sql_cache_clear():
+    with _cache_lock:
+        for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def _paths(key: str) -> (str, str):
+    return os.path.join(cache_dir, key + '.parquet'), os.path.join(cache_dir, key + '.json')
+
+
+def _read_meta(meta_path: str) -> dict:
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(key: str, df: pd.DataFrame, meta: dict):
+    data_path, meta_path = _paths(key)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with _cache_lock:
+            # Write data before meta (and each via a tmp file + rename), so readers never see a partial entry
+            writer = ColumnarWriter(data_path + '.tmp')
+            writer.write(df)
+            writer.close()
+            os.replace(data_path + '.tmp', data_path)
+            with open(meta_path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(meta_path + '.tmp', meta_path)
+            _evict()
+    except Exception as e:
+        print(f'Failed to cache result[{key}]: {e}')
+
+
+def _evict():
+    # Least recently used first, by meta mtime (touched on each hit)
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.json'):
+            data_path, meta_path = _paths(name[:-len('.json')])
+            try:
+                entries.append((os.stat(meta_path).st_mtime, os.stat(data_path).st_size, data_path, meta_path))
+            except OSError:
+                pass
+    n_bytes = sum(size for _, size, _, _ in entries)
+    for _, size, data_path, meta_path in sorted(entries):
+        if n_bytes <= cache_max_bytes:
+            break
+        for path in [meta_path, data_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        n_bytes -= size
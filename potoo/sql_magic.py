@@ -11,7 +11,11 @@ import sqlalchemy as sqla
 from traitlets.config.configurable import Configurable
 from traitlets import Bool, Int, Unicode
 
-from potoo.sqlalchemy import sqla_session
+from potoo.bqq import bq_execute, bq_fetch_results, bq_ledger_record
+from potoo.columnar import ColumnarWriter
+from potoo.pandas import pd_read_sql_chunks, pd_read_sql_copy, pd_read_sql_partitioned
+from potoo.sql_cache import sql_cache_read, sql_cache_table_marker
+from potoo.sqlalchemy import SqlaQuery, sqla_cancellable, sqla_session, sqla_warm_up
 
 
 # TODO How to generically overlay %config defaults + %foo opts? We currently do it manually everywhere.
@@ -40,6 +44,31 @@ class SQLAMagics(SQLMagics):
     # %sqla traits (set via %config)
     #   - conn must be a string because trailets tries and fails to pickle a sqla Session object
     conn = Unicode(None, allow_none=True).tag(config=True)
+    #   - potoo.sqlalchemy.sqla_engine (engines are shared per db url, so pooled connections are reused across cells)
+    pool_size = Int(5).tag(config=True)
+    max_overflow = Int(10).tag(config=True)
+    pool_pre_ping = Bool(True).tag(config=True)
+    pool_recycle = Int(3600).tag(config=True)
+    copy = Bool(False).tag(config=True)  # See --copy
+    cache = Bool(False).tag(config=True)  # See --cache
+    cache_ttl_s = Int(None, allow_none=True).tag(config=True)  # None means potoo.sql_cache.cache_ttl_s
+    #   - Streaming (see --stream)
+    chunksize = Int(100000).tag(config=True)
+    limit_bytes = Int(None, allow_none=True).tag(config=True)  # None means no limit
+    progress_s = Int(5).tag(config=True)  # Print progress at most this often
+
+    def _engine_kwargs(self) -> dict:
+        return dict(
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_pre_ping=self.pool_pre_ping,
+            pool_recycle=self.pool_recycle,
+        )
+
+    def warm_up(self):
+        """Connect to the configured conn in the background, if it names a db url in the environment"""
+        if self.conn and self.conn in os.environ:
+            sqla_warm_up(os.environ[self.conn], **self._engine_kwargs())
 
     @line_cell_magic
     @magic_arguments()
@@ -48,6 +77,21 @@ class SQLAMagics(SQLMagics):
     @argument('-T', '--transpose', action='store_true', help='Transpose the output df (return df.T instead of df)')
     @argument('-q', '--quiet', action='store_true', help='Suppress output to stdout')
     @argument('-c', '--conn', help='sqlalchemy connection/session to use')
+    @argument('--copy', action='store_true', default=argparse.SUPPRESS,
+              help='For postgres, read via COPY ... TO STDOUT instead of row by row (much faster for big results)')
+    @argument('--cache', action='store_true', default=argparse.SUPPRESS,
+              help='Reuse the cached result of the same sql on the same db, if any (see potoo.sql_cache)')
+    @argument('--refresh', action='store_true', help='Re-run and re-cache, ignoring any cached result')
+    @argument('--cache-tables', help='Comma-separated tables: only reuse cached results if they haven\'t changed')
+    @argument('--bg', action='store_true',
+              help='Run in the background and return a SqlaQuery handle (.result(), .cancel(), progress)')
+    @argument('--partitions', type=int, help='Read in this many parallel partitions, over pooled connections')
+    @argument('--partition-on', help='Column to partition on (e.g. an id), for --partitions')
+    @argument('-s', '--stream', action='store_true', help='Fetch in chunks via a server-side cursor (see --chunksize)')
+    @argument('--chunksize', type=int, default=argparse.SUPPRESS, help='Rows per chunk when streaming')
+    @argument('--to-path', help='Stream chunks to this columnar file (or dir/), and return a lazy ColumnarFrame')
+    @argument('--limit-bytes', type=int, default=argparse.SUPPRESS,
+              help='Fail once the streamed result takes more than this much memory (use --to-path for big results)')
     @argument('rest', nargs=argparse.REMAINDER)
     def sqla(self, line, cell=None) -> pd.DataFrame:
 
@@ -62,18 +106,87 @@ class SQLAMagics(SQLMagics):
         if db_conn in self.shell.user_ns:
             db_session = self.shell.user_ns.get(db_conn)
         else:
-            db_session = sqla_session(os.environ[db_conn])
+            db_session = sqla_session(os.environ[db_conn], **self._engine_kwargs())
         db_desc = repr(db_session.session_factory.kw['bind'].url)  # repr masks the password, str doesn't
 
         # Run query
         self._print(args.quiet, 'Running query...')
         start_s = time.time()
-        df = pd.read_sql(
-            sql=sqla.text(code),
-            con=db_session.bind,
-            coerce_float=True,  # True is default -- is this sane?
-        )
-        self._print(args.quiet, '[%.0fs, %s]' % (time.time() - start_s, db_desc))
+        args_dict = dict(args._get_kwargs())
+        limit_bytes = args_dict.get('limit_bytes', self.limit_bytes)
+
+        copy = args_dict.get('copy', self.copy) and db_session.bind.dialect.name == 'postgresql'
+        if args.partitions is not None:
+            if args.partition_on is None:
+                raise ValueError('--partitions requires --partition-on')
+            if args.stream or args.to_path or limit_bytes is not None:
+                raise ValueError('--partitions is not supported with --stream, --to-path or --limit-bytes')
+        quiet = args.quiet or args.bg  # Don't print into other cells' output from the background
+
+        # Run on a worker thread (on a pooled connection) in the background, or if the query can be cancelled on the
+        # server, so Ctrl-C can cancel it there. Else run here, e.g. since a sqlite :memory: engine's pool gives each
+        # thread its own connection (and so its own, empty, db)
+        in_worker = args.bg or sqla_cancellable(db_session.bind)
+        if args.bg and isinstance(db_session.bind.pool, sqla.pool.SingletonThreadPool):
+            raise ValueError('--bg is not supported with one connection per thread (e.g. sqlite :memory:)')
+
+        def read(conn, progress):
+            if args.partitions is not None:
+                # Each partition reads on its own pooled connection (see pool_size, max_overflow), not on conn, so
+                # register their cancels with query's
+                return pd_read_sql_partitioned(
+                    db_session.bind, code, args.partition_on, args.partitions, copy=copy,
+                    on_cancel=(lambda hook: query_ref['query'].on_cancel(hook)) if in_worker else None,
+                )
+            # Stream if asked to, or in the background (so progress can report rows as they arrive)
+            elif args.stream or args.to_path or limit_bytes is not None or (args.bg and not copy):
+                return self._read_sql_stream(
+                    quiet, code, conn,
+                    chunksize=args_dict.get('chunksize', self.chunksize),
+                    to_path=args.to_path,
+                    limit_bytes=limit_bytes,
+                    progress=progress,
+                )
+            elif copy:
+                return pd_read_sql_copy(conn, code)
+            else:
+                return pd.read_sql(
+                    sql=sqla.text(code),
+                    con=conn,
+                    coerce_float=True,  # True is default -- is this sane?
+                )
+
+        def read_maybe_cached(conn, progress):
+            # Cache (unless --to-path, which is already on disk)
+            if (args_dict.get('cache', self.cache) or args.refresh or args.cache_tables) and not args.to_path:
+                cache_tables = args.cache_tables.split(',') if args.cache_tables else None
+                return sql_cache_read(
+                    db_session.bind.url, code, lambda: read(conn, progress),
+                    ttl_s='default' if self.cache_ttl_s is None else self.cache_ttl_s,
+                    marker=cache_tables and (lambda: sql_cache_table_marker(conn, cache_tables)),
+                    refresh=args.refresh,
+                    quiet=quiet or self.quiet,
+                )
+            else:
+                return read(conn, progress)
+
+        query_ref = {}
+        if in_worker:
+            query = query_ref['query'] = SqlaQuery(db_session.bind, read_maybe_cached)
+        if args.bg:
+            df = query
+        else:
+            if in_worker:
+                try:
+                    df = query.result()
+                except KeyboardInterrupt:
+                    self._print(args.quiet, 'Interrupted: cancelling query...')
+                    query.cancel()
+                    raise
+            else:
+                with db_session.bind.connect() as conn:
+                    df = read_maybe_cached(conn, {})
+            self._print(args.quiet, '[%.0fs, %s]' % (time.time() - start_s, db_desc))
 
         # Store output
         if args.out:
@@ -81,7 +194,49 @@ class SQLAMagics(SQLMagics):
 
         # Return (maybe)
         if not args.no_return:
-            return df.T if args.transpose else df
+            return df.T if args.transpose and isinstance(df, pd.DataFrame) else df
+
+    def _read_sql_stream(self, quiet, code, bind, chunksize, to_path=None, limit_bytes=None, progress=None):
+        """
+        Read in chunks, holding at most one chunk in memory if to_path (returns a ColumnarFrame), else all chunks up to
+        limit_bytes (returns a df)
+        """
+        writer = None
+        dfs = []
+        n_rows = 0
+        n_bytes = 0
+        start_s = time.time()
+        last_print_s = start_s
+
+        # Pin the file schema from the result description, else it's whatever the first chunk infers (e.g. null)
+        def on_types(types):
+            nonlocal writer
+            if to_path:
+                writer = ColumnarWriter(to_path, types=types)
+
+        for df in pd_read_sql_chunks(bind, sqla.text(code), chunksize, on_types=on_types):
+            n_rows += len(df)
+            if progress is not None:
+                progress['rows'] = n_rows
+            if writer:
+                writer.write(df)
+            else:
+                dfs.append(df)
+                n_bytes += int(df.memory_usage(deep=True).sum())
+                if limit_bytes is not None and n_bytes > limit_bytes:
+                    raise MemoryError(
+                        f'Result exceeded --limit-bytes[{limit_bytes}] after {n_rows} rows (try --to-path)'
+                    )
+            if time.time() - last_print_s >= self.progress_s:
+                last_print_s = time.time()
+                elapsed_s = last_print_s - start_s
+                self._print(quiet, '  %s rows [%.0fs, %.0f rows/s%s]' % (
+                    n_rows, elapsed_s, n_rows / elapsed_s, '' if writer else ', %s in memory' % n_bytes,
+                ))
+        if writer:
+            return writer.close()
+        else:
+            return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
 
 
 @magics_class
@@ -98,7 +253,7 @@ class BQMagics(SQLMagics):
     allow_large_results = Bool(False).tag(config=True)
     dialect = Unicode('standard').tag(config=True)  # Impose sane default (lib default is 'legacy')
     billing_tier = Int(None, allow_none=True).tag(config=True)  # None means use project default
-    #   - bq.QueryResultsTable.to_dataframe
+    #   - potoo.bqq.bq_fetch_results (like bq.QueryResultsTable.to_dataframe)
     start_row = Int(0).tag(config=True)
     max_rows = Int(None, allow_none=True).tag(config=True)
 
@@ -118,7 +273,7 @@ class BQMagics(SQLMagics):
     @argument('--allow_large_results', type=bool, default=argparse.SUPPRESS)
     @argument('--dialect', type=str, default=argparse.SUPPRESS)
     @argument('--billing_tier', type=int, default=argparse.SUPPRESS)
-    #   - bq.QueryResultsTable.to_dataframe
+    #   - potoo.bqq.bq_fetch_results (like bq.QueryResultsTable.to_dataframe)
     @argument('--start_row', type=int, default=argparse.SUPPRESS)
     @argument('--max_rows', type=int, default=argparse.SUPPRESS)
     @argument('rest', nargs=argparse.REMAINDER)
@@ -132,10 +287,9 @@ class BQMagics(SQLMagics):
             for k in inspect.signature(bq.Query.execute).parameters.keys()
             if k in args_dict or hasattr(self, k)
         }
-        to_dataframe_kwargs = {
+        fetch_kwargs = {
             k: args_dict.get(k, getattr(self, k))
-            for k in inspect.signature(bq.QueryResultsTable.to_dataframe).parameters.keys()
-            if k in args_dict or hasattr(self, k)
+            for k in ['start_row', 'max_rows']
         }
 
         # Parse code
@@ -145,14 +299,18 @@ class BQMagics(SQLMagics):
         # Run query
         self._print(args.quiet, 'Running query...')
         start_s = time.time()
-        query = bq.Query(code).execute(**execute_kwargs)
-        self._print(args.quiet, '[%.0fs, %s]' % (time.time() - start_s, bq_url_for_query(query)))
+        query = bq_execute(bq.Query(code), **execute_kwargs)
+        query_s = time.time() - start_s
+        self._print(args.quiet, '[%.0fs, %s]' % (query_s, bq_url_for_query(query)))
 
         # Fetch results
         self._print(args.quiet, 'Fetching results...')
         start_s = time.time()
-        df = query.results.to_dataframe(**to_dataframe_kwargs)
-        self._print(args.quiet, '[%.0fs]' % (time.time() - start_s))
+        stats = {}
+        df = bq_fetch_results(query, **fetch_kwargs, stats=stats, verbose=not (args.quiet or self.quiet))
+        fetch_s = time.time() - start_s
+        self._print(args.quiet, '[%.0fs]' % fetch_s)
+        bq_ledger_record('%bq', code, query, query_s, fetch_s, df, stats)
 
         # Store output
         if args.out:
@@ -169,5 +327,7 @@ def bq_url_for_query(query: bq.QueryJob) -> str:
 
 def load_ipython_extension(ipy):
     ipy.register_magics(SQLMagics)
-    ipy.register_magics(SQLAMagics)
+    sqla_magics = SQLAMagics(ipy)
+    ipy.register_magics(sqla_magics)
+    sqla_magics.warm_up()
     ipy.register_magics(BQMagics)
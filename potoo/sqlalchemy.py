@@ -1,22 +1,206 @@
+import threading
+import time
+
 import sqlalchemy as sqla
 import sqlalchemy.orm as sqlo
 
 
-def sqla_session(db_url):
+# Process-wide engines by (db_url, engine kwargs), so every session on the same db shares one connection pool instead
+# of paying a new tcp + tls + auth handshake every time
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def sqla_db_url(db_url):
+    if '/' not in db_url:
+        db_url = f'postgres://localhost/{db_url}'
+    return db_url
+
+
+def sqla_engine(db_url, pool_size=5, max_overflow=10, pool_pre_ping=True, pool_recycle=3600, **kwargs):
+    """
+    Get (or create) the shared engine for db_url. Example usage:
+
+        engine = sqla_engine(...)
+        df = pd.read_sql(sql=..., con=engine)
+
+    Pool params:
+    - pool_size/max_overflow: connections kept open / allowed beyond that under load (ignored for sqlite)
+    - pool_pre_ping: test connections on checkout, so connections dropped by the server (or a laptop sleep) are
+      transparently replaced instead of failing the next query
+    - pool_recycle: replace connections older than this many seconds, before the server (or a proxy) times them out
+    """
+    db_url = sqla_db_url(db_url)
+    if not sqla.engine.url.make_url(db_url).drivername.startswith('sqlite'):  # sqlite pools don't take a size
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+    kwargs.update(pool_pre_ping=pool_pre_ping, pool_recycle=pool_recycle)
+    key = (db_url, tuple(sorted(kwargs.items())))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = sqla.create_engine(
+                db_url,
+                convert_unicode=True,
+                **kwargs,
+            )
+        return _engines[key]
+
+
+def sqla_warm_up(db_url, **kwargs) -> threading.Thread:
+    """
+    Open (and return to the pool) one connection for db_url in the background, so the first query doesn't wait on the
+    handshake
     """
-    Do a pile of sane defaults to get a sqla session. Example usage:
+    def warm_up():
+        try:
+            sqla_engine(db_url, **kwargs).connect().close()
+        except Exception as e:
+            print(f'Failed to warm up db connection[{sqla.engine.url.make_url(sqla_db_url(db_url))!r}]: {e}')
+    thread = threading.Thread(target=warm_up, daemon=True)
+    thread.start()
+    return thread
+
+
+def sqla_session(db_url, **kwargs):
+    """
+    Do a pile of sane defaults to get a sqla session, on the shared engine for db_url (kwargs are passed through to
+    sqla_engine). Example usage:
 
         db = sqla_session(...)
         df = pd.read_sql(sql=..., con=db.bind)
     """
-    if '/' not in db_url:
-        db_url = f'postgres://localhost/{db_url}'
     return sqlo.scoped_session(
         sqlo.sessionmaker(
             autocommit=True,
-            bind=sqla.create_engine(
-                db_url,
-                convert_unicode=True,
-            ),
+            bind=sqla_engine(db_url, **kwargs),
         ),
     )
+
+
+def sqla_cancellable(engine) -> bool:
+    """
+    Whether SqlaQuery can cancel engine's queries on the server: postgres (via pg_cancel_backend), and not with a pool
+    of one connection per thread (SingletonThreadPool, e.g. sqlite :memory:), where a worker thread gets its own db
+    """
+    return engine.dialect.name == 'postgresql' and not isinstance(engine.pool, sqla.pool.SingletonThreadPool)
+
+
+class SqlaQuery:
+    """
+    Handle to a query running on a worker thread, on its own connection from engine's pool, so it can be cancelled
+    server-side -- unlike a plain Ctrl-C, which only interrupts the python side and leaves the query running
+
+    Example usage:
+        q = SqlaQuery(engine, lambda conn, progress: pd.read_sql(sql, conn))
+        q            # Status and progress
+        q.cancel()   # Cancel on the server; q.result() then raises the driver's cancel error
+        df = q.result()
+
+    read(conn, progress) runs on the worker thread, and can report progress by updating the progress dict (e.g.
+    progress['rows'] as chunks arrive). If it runs queries on other connections, it can register their cancels via
+    on_cancel.
+    """
+
+    def __init__(self, engine, read):
+        self._engine = engine
+        self._read = read
+        self.progress = {}
+        self._dbapi_conn = None
+        self._backend_pid = None
+        self._result = None
+        self._error = None
+        self._cancelled = False
+        self._finished = False  # Set (under _lock) before the connection goes back to the pool
+        self._cancel_hooks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._start_s = time.time()
+        self._end_s = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with self._engine.connect() as conn:
+                try:
+                    with self._lock:
+                        if self._cancelled:
+                            raise QueryCancelled('Cancelled before it started')
+                        self._dbapi_conn = conn.connection
+                        if conn.dialect.name == 'postgresql':
+                            self._backend_pid = conn.execute('select pg_backend_pid()').scalar()
+                    if self._cancelled:  # Cancelled while we were getting the pid
+                        raise QueryCancelled('Cancelled before it started')
+                    self._result = self._read(conn, self.progress)
+                finally:
+                    # Before conn goes back to the pool, where another query could get it (and our cancel with it)
+                    with self._lock:
+                        self._finished = True
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._end_s = time.time()
+            self._done.set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f'Query still running after {timeout}s')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def cancel(self):
+        """
+        Cancel the query on the server (best effort): via pg_cancel_backend on a second pooled connection for postgres,
+        else via the driver's own cancel (e.g. a separate cancel request), if it has one
+        """
+        with self._lock:
+            self._cancelled = True
+            cancel_hooks, self._cancel_hooks = self._cancel_hooks, []
+        for hook in cancel_hooks:
+            hook()
+        # Hold the lock while cancelling, so _run can't return the connection to the pool (and another query can't
+        # start on its backend) until the cancel has been sent
+        with self._lock:
+            if self._finished or self._dbapi_conn is None:
+                return
+            try:
+                if self._backend_pid is not None:
+                    with self._engine.connect() as conn:
+                        conn.execute('select pg_cancel_backend(%s)' % int(self._backend_pid))
+                else:
+                    getattr(self._dbapi_conn, 'connection', self._dbapi_conn).cancel()  # Unwrap the pool's proxy
+            except Exception as e:
+                print(f'Failed to cancel query: {e}')
+
+    def on_cancel(self, hook):
+        """
+        Also call hook() on cancel (or now, if already cancelled), e.g. for read to cancel queries it runs on other
+        connections
+        """
+        with self._lock:
+            if not self._cancelled:
+                self._cancel_hooks.append(hook)
+                return
+        hook()
+
+    @property
+    def elapsed_s(self) -> float:
+        return (self._end_s or time.time()) - self._start_s
+
+    def __repr__(self):
+        status = (
+            'running' if not self.done() else
+            'cancelled' if self._cancelled and self._error is not None else
+            'failed' if self._error is not None else
+            'done'
+        )
+        return 'SqlaQuery(%s, %.0fs%s)' % (status, self.elapsed_s, ''.join(
+            ', %s=%s' % (k, v) for k, v in self.progress.items()
+        ))
+
+
+class QueryCancelled(Exception):
+    pass
@@ -70,6 +70,12 @@ def timed(f, if_error_return='exception'):
     return elapsed_s, x
 
 
+def peak_rss_bytes():
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024  # Bytes on mac, KB on linux
+
+
 def format_duration(secs):
     """
     >>> format_duration(0)